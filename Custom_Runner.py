@@ -1,16 +1,20 @@
 import time, subprocess, os
 
 BASE = os.path.dirname(os.path.abspath(__file__))
-CMD = [os.path.join(BASE, "venv/bin/python"), os.path.join(BASE, "ingest_outlook_imap_to_postgres.py")]
+CMD = [os.path.join(BASE, "venv/bin/python"), os.path.join(BASE, "ingest_outlook_imap_to_postgres.py"), "--daemon"]
 
-end_time = time.time() + 15*60  # 15 minutes from now
-
-while time.time() < end_time:
-    print("▶︎ Running ingest...")
+# The ingest stays resident (IMAP IDLE) instead of being re-run every 2 minutes;
+# this only restarts it if it exits, backing off when it keeps failing.
+backoff = 10
+while True:
+    print("▶︎ Starting ingest daemon...")
+    started = time.time()
     try:
         subprocess.run(CMD, check=False)
+    except KeyboardInterrupt:
+        print("⏹️ Runner stopped.")
+        break
     except Exception as e:
         print("ERROR:", e)
-    time.sleep(120)  # poll every 2 minutes
-
-print("⏹️ Runner finished after 15 minutes.")
+    backoff = 10 if time.time() - started > 300 else min(backoff * 2, 300)
+    time.sleep(backoff)
@@ -0,0 +1,139 @@
+"""
+Content-addressed store for downloaded PDF attachments.
+
+Attachments arrive as chunks of still-encoded body data (base64, quoted-printable or raw). store()
+decodes them a chunk at a time straight into a temp file, computing SHA-256 while writing, then
+renames the file to DOWNLOAD_DIR/<sha[:2]>/<sha>.pdf. Memory per attachment is one chunk instead
+of the whole decoded part, and the same PDF sent twice (or under another name) is stored once: the
+second copy is just dropped. The SHA-256 doubles as the dedup key and the OCR cache key.
+
+    att = store(chunks, "base64", "INV-1001.pdf")
+    att.path, att.sha256, att.file_name, att.duplicate
+
+file_name ("<sha[:16]>_<original name>") is what the ingest records as the invoice file: readable,
+and it no longer needs a timestamp prefix to stay unique.
+
+Env:
+  DOWNLOAD_DIR=inbox_downloads
+  ATTACH_DECODE_CHUNK=65536
+"""
+
+import os
+import re
+import base64
+import hashlib
+import binascii
+import tempfile
+from pathlib import Path
+
+DOWNLOAD_DIR        = Path(os.getenv("DOWNLOAD_DIR", "inbox_downloads"))
+ATTACH_DECODE_CHUNK = int(os.getenv("ATTACH_DECODE_CHUNK", str(64 * 1024)))
+
+_WS = re.compile(rb"\s+")
+_UNSAFE = re.compile(r"[^\w.\- ]+")
+
+stats = {"stored": 0, "duplicates": 0, "bytes": 0}
+
+
+class StoredAttachment:
+    def __init__(self, path, sha256, size, filename, duplicate):
+        self.path = str(path)
+        self.sha256 = sha256
+        self.size = size
+        self.filename = filename
+        self.duplicate = duplicate   # same content was already in the store
+
+    @property
+    def file_name(self):
+        return f"{self.sha256[:16]}_{self.filename}"
+
+    def __repr__(self):
+        return f"StoredAttachment({self.file_name}, {self.size}B{', duplicate' if self.duplicate else ''})"
+
+
+def path_for(sha256: str) -> Path:
+    return DOWNLOAD_DIR / sha256[:2] / f"{sha256}.pdf"
+
+
+def _b64_decode(chunks):
+    """Decode base64 a chunk at a time; line breaks may fall anywhere, so carry leftover quads."""
+    rest = b""
+    for chunk in chunks:
+        data = rest + _WS.sub(b"", chunk)
+        cut = len(data) - len(data) % 4
+        rest = data[cut:]
+        if cut:
+            yield base64.b64decode(data[:cut])
+    if rest:
+        yield base64.b64decode(rest + b"=" * (-len(rest) % 4))
+
+
+def _qp_decode(chunks):
+    """Quoted-printable: decode whole lines, keep the unfinished one for the next chunk."""
+    rest = b""
+    for chunk in chunks:
+        data = rest + chunk
+        cut = data.rfind(b"\n") + 1
+        rest = data[cut:]
+        if cut:
+            yield binascii.a2b_qp(data[:cut])
+    if rest:
+        yield binascii.a2b_qp(rest)
+
+
+def _rechunk(chunks, size=ATTACH_DECODE_CHUNK):
+    """Split big input blocks so decoding never holds more than one chunk's worth of output."""
+    for chunk in chunks:
+        for i in range(0, len(chunk), size):
+            yield chunk[i:i + size]
+
+
+def decoded(chunks, encoding):
+    encoding = (encoding or "").lower()
+    chunks = _rechunk(chunks)
+    if encoding == "base64":
+        return _b64_decode(chunks)
+    if encoding == "quoted-printable":
+        return _qp_decode(chunks)
+    return chunks  # 7bit / 8bit / binary
+
+
+def store(chunks, encoding, filename):
+    """
+    Decode + hash + write in one pass; returns a StoredAttachment pointing at the stored content
+    (the existing copy if it is a duplicate), or None for an empty part.
+    """
+    DOWNLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    h = hashlib.sha256()
+    size = 0
+    fd, tmp = tempfile.mkstemp(dir=DOWNLOAD_DIR, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for block in decoded(chunks, encoding):
+                h.update(block)
+                f.write(block)
+                size += len(block)
+        if not size:
+            os.unlink(tmp)
+            return None
+        sha = h.hexdigest()
+        dest = path_for(sha)
+        duplicate = dest.exists()
+        if duplicate:
+            os.unlink(tmp)
+            stats["duplicates"] += 1
+        else:
+            dest.parent.mkdir(exist_ok=True)
+            os.replace(tmp, dest)
+            stats["stored"] += 1
+            stats["bytes"] += size
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    name = _UNSAFE.sub("_", os.path.basename(filename or "attachment.pdf")).strip() or "attachment.pdf"
+    return StoredAttachment(dest, sha, size, name, duplicate)
+
+
+def summary() -> str:
+    return f"stored={stats['stored']} duplicates={stats['duplicates']} bytes={stats['bytes']}"
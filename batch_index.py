@@ -0,0 +1,246 @@
+"""
+Crash-safe checkpoint index for batch results (used by batch_runner.py and llm_batch.py).
+
+Next to every results JSONL lives <out>.idx, an append-only sidecar with one line per processed
+file:
+
+  name  sha256  size  mtime_ns  status  offset  crc32
+
+- sha256/size/mtime_ns identify the input PDF. Resume trusts an entry while the file's size and
+  mtime are unchanged and re-hashes only when they differ, so a file that was replaced under the
+  same name is processed again (its new result is appended; the latest entry wins).
+- status is "ok" (offset = byte offset of its result line) or "failed" (retried next run).
+- crc32 covers the rest of the line, so a torn or garbled line is recognized and ignored.
+
+Opening the index also repairs what a crash can leave behind:
+- a partial last line in the results file is truncated away (it was never indexed);
+- complete result lines after the last indexed one (written, crash before their index entry)
+  are indexed from the results tail instead of being processed again;
+- a results file with no index at all is indexed once from scratch.
+An index that is mostly superseded lines is compacted on open.
+
+Writes go results first, fsync, then index lines, fsync (every BATCH_FSYNC_EVERY files), so an
+index entry never points at a result that isn't on disk.
+
+Env:
+  BATCH_FSYNC_EVERY=16
+"""
+
+import os
+import json
+import zlib
+
+from ocr_cache import file_sha256
+
+BATCH_FSYNC_EVERY = int(os.getenv("BATCH_FSYNC_EVERY", "16"))
+
+UNKNOWN = "-"  # sha of entries recovered from results written without one
+
+
+class Entry:
+    __slots__ = ("sha", "size", "mtime_ns", "status", "offset")
+
+    def __init__(self, sha, size, mtime_ns, status, offset):
+        self.sha = sha
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.status = status
+        self.offset = offset
+
+
+def _line(name, e: Entry) -> str:
+    body = f"{name}\t{e.sha}\t{e.size}\t{e.mtime_ns}\t{e.status}\t{e.offset}"
+    return f"{body}\t{zlib.crc32(body.encode('utf-8')):08x}\n"
+
+
+def _parse(line: str):
+    body, _, crc = line.rstrip("\n").rpartition("\t")
+    if not body or crc != f"{zlib.crc32(body.encode('utf-8')):08x}":
+        return None
+    name, sha, size, mtime_ns, status, offset = body.split("\t")
+    return name, Entry(sha, int(size), int(mtime_ns), status, int(offset))
+
+
+def _truncate_partial_line(path) -> int:
+    """Cut a file back to its last newline; returns the resulting size."""
+    size = os.path.getsize(path)
+    if not size:
+        return 0
+    with open(path, "rb+") as f:
+        pos = size
+        while pos > 0:
+            step = min(64 * 1024, pos)
+            f.seek(pos - step)
+            block = f.read(step)
+            nl = block.rfind(b"\n")
+            if nl >= 0:
+                end = pos - step + nl + 1
+                break
+            pos -= step
+        else:
+            end = 0
+        if end != size:
+            f.truncate(end)
+            f.flush()
+            os.fsync(f.fileno())
+            print(f"[INDEX] dropped {size - end} bytes of partial line at the end of {path}")
+    return end
+
+
+class BatchIndex:
+    def __init__(self, out_path):
+        self.out_path = out_path
+        self.path = out_path + ".idx"
+        self.entries = {}
+        self._recover()
+
+    # ---------- startup ----------
+
+    def _recover(self):
+        results_size = _truncate_partial_line(self.out_path) if os.path.exists(self.out_path) else 0
+
+        bad = lines = 0
+        if os.path.exists(self.path):
+            _truncate_partial_line(self.path)
+            with open(self.path, "r", encoding="utf-8", errors="replace") as f:
+                for line in f:
+                    lines += 1
+                    parsed = _parse(line)
+                    if parsed is None:
+                        bad += 1
+                        continue
+                    name, e = parsed
+                    if e.status == "ok" and e.offset >= results_size:
+                        bad += 1   # points past the results file (results restored from an older copy?)
+                        continue
+                    self.entries[name] = e
+        if bad:
+            print(f"[INDEX] ignored {bad} unusable line(s) in {self.path}, rewriting it")
+            self._rewrite()
+        elif lines > 2 * len(self.entries) + 1000:  # mostly superseded lines: compact
+            self._rewrite()
+
+        # results after the last indexed line were written but their index entries weren't
+        if results_size:
+            offsets = [e.offset for e in self.entries.values() if e.status == "ok"]
+            recovered = self._index_results_from(max(offsets) if offsets else None)
+            if recovered:
+                self._append(recovered)
+                print(f"[INDEX] indexed {len(recovered)} result line(s) missing from {self.path}")
+
+    def _index_results_from(self, last_offset):
+        recovered = []
+        with open(self.out_path, "rb") as f:
+            if last_offset is not None:
+                f.seek(last_offset)
+                f.readline()
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line:
+                    break
+                try:
+                    row = json.loads(line)
+                    name = row["file"]
+                except Exception:
+                    continue
+                e = Entry(row.get("sha256") or UNKNOWN, 0, 0, "ok", offset)
+                self.entries[name] = e
+                recovered.append((name, e))
+        return recovered
+
+    def _rewrite(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(_line(name, e) for name, e in self.entries.items())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def _append(self, items):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(_line(name, e) for name, e in items)
+            f.flush()
+            os.fsync(f.fileno())
+
+    # ---------- lookups ----------
+
+    def __contains__(self, name):
+        e = self.entries.get(name)
+        return e is not None and e.status == "ok"
+
+    def is_done(self, name, path, _touched=None) -> bool:
+        """True if `name` has an ok result for the file currently at `path`."""
+        e = self.entries.get(name)
+        if e is None or e.status != "ok":
+            return False
+        if e.sha == UNKNOWN:
+            return True  # indexed from a result without a hash: can't tell, trust it
+        st = os.stat(path)
+        if (st.st_size, st.st_mtime_ns) == (e.size, e.mtime_ns):
+            return True
+        if file_sha256(path) == e.sha:  # touched but same content: remember the new stat
+            e.size, e.mtime_ns = st.st_size, st.st_mtime_ns
+            if _touched is not None:
+                _touched.append((name, e))
+            return True
+        print(f"[INDEX] {name} changed since it was processed, processing it again")
+        return False
+
+    def todo(self, invoice_dir, names) -> list:
+        """The names that still need processing (new, failed, or changed since)."""
+        touched = []
+        out = [n for n in names if not self.is_done(n, os.path.join(invoice_dir, n), touched)]
+        if touched:
+            self._append(touched)
+        return out
+
+
+class ResultWriter:
+    """Results JSONL + index entries; results are fsynced before the index lines that point at them."""
+
+    def __init__(self, out_path, index: BatchIndex):
+        self.index = index
+        self.out = open(out_path, "ab")
+        self.idx = open(index.path, "a", encoding="utf-8")
+        self.unsynced = []       # (name, Entry) not yet in the index file
+        self.written = 0
+
+    @staticmethod
+    def _stat(path):
+        if path is None:
+            return 0, 0
+        st = os.stat(path)
+        return st.st_size, st.st_mtime_ns
+
+    def write(self, name, output, sha=None, path=None):
+        offset = self.out.tell()
+        row = {"file": name, "output": output}
+        if sha:
+            row["sha256"] = sha
+        self.out.write((json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8"))
+        self.unsynced.append((name, Entry(sha or UNKNOWN, *self._stat(path), "ok", offset)))
+        self.written += 1
+        if len(self.unsynced) >= BATCH_FSYNC_EVERY:
+            self.sync()
+
+    def fail(self, name, sha=None, path=None):
+        """Record a failure (no result line); the file is retried on the next run."""
+        self.unsynced.append((name, Entry(sha or UNKNOWN, *self._stat(path), "failed", -1)))
+
+    def sync(self):
+        if not self.unsynced:
+            return
+        self.out.flush()
+        os.fsync(self.out.fileno())           # results durable first …
+        for name, e in self.unsynced:          # … then the index may point at them
+            self.idx.write(_line(name, e))
+            self.index.entries[name] = e
+        self.idx.flush()
+        os.fsync(self.idx.fileno())
+        self.unsynced = []
+
+    def close(self):
+        self.sync()
+        self.out.close()
+        self.idx.close()
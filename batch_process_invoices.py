@@ -1,22 +1,14 @@
 import os
-import openai
-import pytesseract
-from pdf2image import convert_from_path
 import json
 
+from ocr import extract_text_from_pdf
+from llm_extract import get_client, connection_summary
+
 # ✅ CONFIG
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+client = get_client()  # shared keep-alive client
 invoice_dir = "invoices_output"
 output_file =  "results_styled.jsonl"
 
-# ✅ OCR function
-def extract_text_from_pdf(pdf_path):
-    images = convert_from_path(pdf_path)
-    text = ""
-    for img in images:
-        text += pytesseract.image_to_string(img)
-    return text
-
 # ✅ GPT function using updated SDK
 def extract_fields_with_gpt(text):
     prompt = f"""
@@ -41,21 +33,23 @@ Invoice Text:
     )
     return response.choices[0].message.content
 
-# ✅ Main batch loop
-with open(output_file, "w") as f_out:
-    for filename in os.listdir(invoice_dir):
-        if filename.endswith(".pdf"):
-            filepath = os.path.join(invoice_dir, filename)
-            print(f"📄 Processing: {filename}")
-            
-            try:
-                text = extract_text_from_pdf(filepath)
-                extracted = extract_fields_with_gpt(text)
-                result = {
-                    "file": filename,
-                    "output": json.loads(extracted)
-                }
-                f_out.write(json.dumps(result) + "\n")
-                print("✅ Success")
-            except Exception as e:
-                print(f"❌ Failed to process {filename}: {e}")
+if __name__ == "__main__":  # OCR workers re-import this module
+    # ✅ Main batch loop
+    with open(output_file, "w") as f_out:
+        for filename in os.listdir(invoice_dir):
+            if filename.endswith(".pdf"):
+                filepath = os.path.join(invoice_dir, filename)
+                print(f"📄 Processing: {filename}")
+
+                try:
+                    text = extract_text_from_pdf(filepath)
+                    extracted = extract_fields_with_gpt(text)
+                    result = {
+                        "file": filename,
+                        "output": json.loads(extracted)
+                    }
+                    f_out.write(json.dumps(result) + "\n")
+                    print("✅ Success")
+                except Exception as e:
+                    print(f"❌ Failed to process {filename}: {e}")
+    print("[GPT] connections:", connection_summary())
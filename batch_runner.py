@@ -0,0 +1,184 @@
+"""
+Parallel batch extraction for a folder of invoice PDFs (replaces the one-file-at-a-time loops in
+batch_process_full_fields.py and resume_batch_process.py, which are now thin wrappers around this).
+
+Files flow through a pipeline.Pipeline: --workers OCR threads pull the next PDF off a shared queue
+(an idle worker always takes the next file, so one 60-page statement never holds up the rest) and
+fan its pages out to an OCR process pool of the same size; --llm-concurrency async workers send the
+texts to GPT under the shared rate limiter; the main thread writes results in input order.
+
+Resume is driven by the checkpoint index next to the results file (<out>.idx, see batch_index.py):
+file → content hash → status → result offset, written only after the result lines are fsynced.
+Startup reads that small index instead of json-parsing every result, repairs a torn last line,
+and re-processes files whose content changed under the same name.
+
+Usage:
+  python batch_runner.py --dir invoices_output --out results_full_fields.jsonl --workers 8
+  python batch_runner.py --dir bulk_invoices --out results_styled.jsonl --prompt styled
+  python batch_runner.py --dir invoices_output --out results_full_fields.jsonl --batch-api [--resume]
+  python batch_runner.py --dir invoices_output --out results_full_fields.jsonl --parquet results_parquet
+
+--parquet also writes every result as a typed row into a Parquet dataset (columnar_sink.py).
+"""
+
+import os
+import json
+import time
+import argparse
+import threading
+
+import ocr
+from ocr import extract_texts
+from llm_extract import (
+    Prompt, FULL_PROMPT, extract_fields_async, background_loop, connection_summary, LLM_CONCURRENCY,
+)
+import llm_cache
+from ocr_cache import file_sha256
+from pipeline import Pipeline, Stage, Failed
+from batch_index import BatchIndex, ResultWriter
+
+
+# ---------- prompts ----------
+
+def build_styled_messages(text: str) -> list:
+    """The short 4-field prompt of the styled result files."""
+    prompt = f"""
+Extract the following fields from the invoice text below:
+
+- Invoice Number
+- Date
+- Vendor
+- Total Amount
+
+Respond in JSON format only.
+
+Invoice Text:
+\"\"\"
+{text}
+\"\"\"
+"""
+    return [{"role": "user", "content": prompt}]
+
+
+PROMPTS = {
+    "full":   FULL_PROMPT,
+    "styled": Prompt("styled-v1", "gpt-3.5-turbo", build_styled_messages, json.loads),
+}
+
+
+# ---------- pipeline ----------
+
+class FileJob:
+    def __init__(self, seq, name, path):
+        self.seq = seq
+        self.name = name
+        self.path = path
+        self.sha = None
+        self.text = None
+        self.output = None
+
+
+def run(invoice_dir, out_path, workers=None, llm_concurrency=None, prompt="full", parquet_dir=None):
+    """Extract every PDF in invoice_dir that is not in out_path's completion index yet."""
+    workers = workers or ocr.OCR_WORKERS
+    llm_concurrency = llm_concurrency or LLM_CONCURRENCY
+    ocr.OCR_WORKERS = workers  # size of the page-level OCR process pool
+    prompt = PROMPTS[prompt]
+
+    index = BatchIndex(out_path)
+    all_files = sorted(f for f in os.listdir(invoice_dir) if f.lower().endswith(".pdf"))
+    todo = index.todo(invoice_dir, all_files)
+    print(f"📄 {len(todo)} of {len(all_files)} PDFs to process "
+          f"({workers} OCR workers, {llm_concurrency} GPT requests in flight)")
+    if not todo:
+        return
+
+    def ocr_stage(job):
+        job.sha = file_sha256(job.path)  # index key for change detection, and the OCR cache key
+        job.text = extract_texts([job.path], shas={job.path: job.sha})[job.path]
+        return job
+
+    async def extract_stage(job):
+        job.output = await extract_fields_async(job.text, prompt=prompt)
+        job.text = None  # the writer doesn't need it; keep memory flat
+        return job
+
+    pipe = Pipeline([
+        Stage("ocr",     ocr_stage,     workers=workers),
+        Stage("extract", extract_stage, workers=llm_concurrency, kind="async", loop=background_loop()),
+    ]).start()
+
+    def feed():
+        try:
+            for seq, name in enumerate(todo):
+                pipe.submit(FileJob(seq, name, os.path.join(invoice_dir, name)))
+        finally:
+            pipe.close()
+
+    threading.Thread(target=feed, name="batch-feed", daemon=True).start()
+
+    writer = ResultWriter(out_path, index)
+    sink = None
+    if parquet_dir:
+        from columnar_sink import ColumnarSink
+        sink = ColumnarSink(parquet_dir)
+    t0 = time.perf_counter()
+    pending, next_seq, failed, reported = {}, 0, 0, 0
+    try:
+        for job in pipe.results():
+            if isinstance(job, Failed):
+                print(f"❌ Failed to process {job.item.name} ({job.stage}): {job.error}")
+                failed += 1
+                pending[job.item.seq] = job
+            else:
+                pending[job.seq] = job
+            while next_seq in pending:  # hold early finishers until everything before them is written
+                done = pending.pop(next_seq)
+                if isinstance(done, Failed):
+                    writer.fail(done.item.name, done.item.sha, done.item.path)
+                else:
+                    writer.write(done.name, done.output, done.sha, done.path)
+                    if sink:
+                        sink.add(done.name, done.output, done.sha)
+                next_seq += 1
+            n = writer.written + failed
+            if n // 50 > reported:
+                reported = n // 50
+                print(f"[BATCH] {n}/{len(todo)} ({n / (time.perf_counter() - t0):.1f} files/s)")
+    finally:
+        writer.close()
+        if sink:
+            sink.close()
+        ocr.shutdown_pool()
+
+    print(f"✅ {writer.written} written, {failed} failed in {time.perf_counter() - t0:.0f}s")
+    print("[PIPELINE]", pipe.summary())
+    print("[GPT] connections:", connection_summary(), "| cache", llm_cache.summary())
+
+
+def main(argv=None, **defaults):
+    ap = argparse.ArgumentParser(description="Parallel OCR + GPT extraction for a folder of invoice PDFs")
+    ap.add_argument("--dir", default="invoices_output")
+    ap.add_argument("--out", default="results_full_fields.jsonl")
+    ap.add_argument("--workers", type=int, default=None, help="OCR workers/processes (default: OCR_WORKERS)")
+    ap.add_argument("--llm-concurrency", type=int, default=None, help="GPT requests in flight (default: LLM_CONCURRENCY)")
+    ap.add_argument("--prompt", choices=sorted(PROMPTS), default="full")
+    ap.add_argument("--batch-api", action="store_true", help="send the prompts through the OpenAI Batch API instead")
+    ap.add_argument("--resume", action="store_true", help="with --batch-api: keep polling an interrupted batch")
+    ap.add_argument("--parquet", metavar="DIR", default=None, help="also write typed rows to a Parquet dataset here")
+    ap.set_defaults(**defaults)
+    args = ap.parse_args(argv)
+
+    if args.batch_api:
+        if args.prompt != "full":
+            ap.error("--batch-api only supports --prompt full")
+        if args.parquet:
+            ap.error("--parquet is not supported with --batch-api; convert the JSONL with columnar_sink.py")
+        from llm_batch import run_batch_job
+        run_batch_job(args.dir, args.out, resume=args.resume)
+        return
+    run(args.dir, args.out, args.workers, args.llm_concurrency, args.prompt, args.parquet)
+
+
+if __name__ == "__main__":
+    main()
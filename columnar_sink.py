@@ -0,0 +1,259 @@
+"""
+Typed, columnar copy of the extraction results (Parquet via pyarrow), next to the JSONL.
+
+The JSONL keeps every field as the string GPT returned ("$1,234.56", "09/10/2025"), so every
+reader re-parses JSON and re-cleans amounts. ColumnarSink normalizes once on write:
+
+  amounts (subtotal, tax_amount, total_amount)  decimal128(18, 2)   exact, via normalize.as_money
+  dates (invoice_date, due_date)                date32              via normalize.as_date
+  currency                                      dictionary<string>  a handful of codes, stored once
+  everything else                               string
+
+Rows are partitioned by invoice month (hive layout: <root>/invoice_month=2025-09/part-….parquet;
+invoices without a date go to invoice_month=unknown). Every flush only adds new part files to the
+partitions it touches, so appending never rewrites existing data. read_month() loads one partition
+with memory_map=True, i.e. a scan of the mapped file instead of parsing JSON.
+
+The JSONL stays the source of truth (the batch index points into it); if a run dies with rows still
+buffered here, rebuild the Parquet copy from it:
+
+  python columnar_sink.py --jsonl results_full_fields.jsonl --out results_parquet
+  python columnar_sink.py --out results_parquet --month 2025-09      # totals per currency
+
+Each flush normalizes its whole buffer column-wise through normalize_batch (pandas) when it is
+installed, and row by row through normalize.py otherwise; both give the same values (amounts of
+10^16 or more, which decimal128(18, 2) can't hold, are null either way).
+
+Needs pyarrow (in requirements.txt); the rest of the project works without it.
+
+Env:
+  PARQUET_BATCH_ROWS=5000   # rows buffered before a flush
+"""
+
+import os
+import json
+import time
+import argparse
+from pathlib import Path
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional: only the columnar output needs it
+    pa = pq = None
+
+try:
+    import numpy as np
+    import normalize_batch
+except ImportError:  # without pandas/numpy rows are normalized one at a time
+    normalize_batch = None
+
+from normalize import as_date, as_money, derive_currency
+
+PARQUET_BATCH_ROWS = int(os.getenv("PARQUET_BATCH_ROWS", "5000"))
+
+# column → key in the extracted fields
+STRING_FIELDS = {
+    "invoice_number":   "Invoice Number",
+    "vendor_name":      "Vendor Name",
+    "vendor_address":   "Vendor Address",
+    "po_number":        "PO Number",
+    "billing_period":   "Billing Period",
+    "account_number":   "Account Number",
+    "account_name":     "Account Name",
+    "account_manager":  "Account Manager",
+    "tax_code":         "Tax Code",
+    "line_description": "Line Description",
+}
+DATE_FIELDS  = {"invoice_date": "Invoice Date", "due_date": "Due Date"}
+MONEY_FIELDS = {"subtotal": "Subtotal", "tax_amount": "Tax Amount", "total_amount": "Total Amount"}
+MONEY_TYPE   = (18, 2)
+MONEY_LIMIT  = 10 ** (MONEY_TYPE[0] - MONEY_TYPE[1])  # |amount| below this fits; above is an OCR misread
+
+
+def _require():
+    if pa is None:
+        raise ImportError("columnar_sink needs pyarrow: pip install pyarrow (it is listed in requirements.txt)")
+
+
+def schema():
+    _require()
+    fields = [pa.field("file", pa.string(), nullable=False), pa.field("sha256", pa.string())]
+    fields += [pa.field(c, pa.string()) for c in STRING_FIELDS]
+    fields += [pa.field(c, pa.date32()) for c in DATE_FIELDS]
+    fields += [pa.field(c, pa.decimal128(*MONEY_TYPE)) for c in MONEY_FIELDS]
+    fields += [pa.field("currency", pa.dictionary(pa.int8(), pa.string()))]
+    return pa.schema(fields)
+
+
+def _str(v):
+    return None if v is None else str(v)
+
+
+def _money(v):
+    """as_money, null when it doesn't fit decimal128(18, 2) (an account number read as a total)."""
+    m = as_money(v)
+    return None if m is None or abs(m) >= MONEY_LIMIT else m
+
+
+def to_row(file_name, out: dict, sha256=None) -> dict:
+    """One typed row from a {"file", "output"} result."""
+    row = {"file": file_name, "sha256": sha256}
+    for col, key in STRING_FIELDS.items():
+        row[col] = _str(out.get(key))
+    for col, key in DATE_FIELDS.items():
+        row[col] = as_date(out.get(key), vendor=out.get("Vendor Name"))
+    for col, key in MONEY_FIELDS.items():
+        row[col] = _money(out.get(key))
+    row["currency"] = derive_currency(out.get("Total Amount"), out.get("Currency"))
+    return row
+
+
+def month_of(row) -> str:
+    d = row["invoice_date"]
+    return d.strftime("%Y-%m") if d else "unknown"
+
+
+def to_table(rows):
+    _require()
+    sch = schema()
+    columns = {}
+    for f in sch:
+        values = [r[f.name] for r in rows]
+        if pa.types.is_dictionary(f.type):
+            columns[f.name] = pa.array(values, type=pa.string()).dictionary_encode().cast(f.type)
+        else:
+            columns[f.name] = pa.array(values, type=f.type)
+    return pa.table(columns, schema=sch)
+
+
+def _decimal_from_cents(cents):
+    """Int64 cents → decimal128(18, 2) without a Decimal per value (the array's raw 128-bit ints)."""
+    valid = cents.notna().to_numpy()
+    raw = np.zeros((len(cents), 2), dtype=np.int64)
+    raw[:, 0] = cents.fillna(0).to_numpy(dtype=np.int64)
+    raw[:, 1] = raw[:, 0] >> 63  # sign-extend into the high word (little endian)
+    mask = pa.array(valid).buffers()[1] if not valid.all() else None
+    return pa.Array.from_buffers(pa.decimal128(*MONEY_TYPE), len(cents), [mask, pa.py_buffer(raw.tobytes())],
+                                 null_count=int((~valid).sum()))
+
+
+def to_table_batch(entries):
+    """(file, out, sha256) entries → (table, month per row), normalized column-wise via normalize_batch."""
+    _require()
+    sch = schema()
+    outs = [out or {} for _, out, _ in entries]
+    df = normalize_batch.normalize_outputs(outs)
+    columns = {
+        "file":   pa.array([e[0] for e in entries], type=pa.string()),
+        "sha256": pa.array([e[2] for e in entries], type=pa.string()),
+    }
+    for col, key in STRING_FIELDS.items():
+        columns[col] = pa.array([_str(o.get(key)) for o in outs], type=pa.string())
+    for col in DATE_FIELDS:
+        columns[col] = pa.array(df[col], from_pandas=True).cast(pa.date32())
+    for col in MONEY_FIELDS:
+        columns[col] = _decimal_from_cents(df[col])
+    columns["currency"] = pa.array(df["currency"].astype(object), type=pa.string(),
+                                   from_pandas=True).dictionary_encode().cast(sch.field("currency").type)
+    months = df["invoice_date"].dt.strftime("%Y-%m").fillna("unknown").tolist()
+    return pa.table(columns, schema=sch), months
+
+
+class ColumnarSink:
+    """Buffer typed rows and append them as Parquet part files, one per touched month partition."""
+
+    def __init__(self, root, batch_rows=PARQUET_BATCH_ROWS):
+        _require()
+        self.root = Path(root)
+        self.batch_rows = batch_rows
+        self.buffer = []
+        self.parts = 0
+        self.rows_written = 0
+
+    def add(self, file_name, out: dict, sha256=None):
+        self.buffer.append((file_name, out or {}, sha256))
+        if len(self.buffer) >= self.batch_rows:
+            self.flush()
+
+    def _tables_by_month(self):
+        if normalize_batch is not None:
+            table, months = to_table_batch(self.buffer)
+            by_month = {}
+            for i, month in enumerate(months):
+                by_month.setdefault(month, []).append(i)
+            return {m: table.take(pa.array(idx, type=pa.int64())) for m, idx in by_month.items()}
+        by_month = {}
+        for file_name, out, sha256 in self.buffer:
+            row = to_row(file_name, out, sha256)
+            by_month.setdefault(month_of(row), []).append(row)
+        return {m: to_table(rows) for m, rows in by_month.items()}
+
+    def flush(self):
+        if not self.buffer:
+            return
+        by_month = self._tables_by_month()
+        stamp = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+        for month, table in sorted(by_month.items()):
+            part_dir = self.root / f"invoice_month={month}"
+            part_dir.mkdir(parents=True, exist_ok=True)
+            path = part_dir / f"part-{stamp}-{self.parts:05d}.parquet"
+            tmp = path.with_suffix(".parquet.tmp")
+            pq.write_table(table, tmp, compression="zstd")
+            os.replace(tmp, path)  # readers never see a half-written part
+            self.parts += 1
+        self.rows_written += len(self.buffer)
+        print(f"[PARQUET] {len(self.buffer)} rows → {len(by_month)} partition(s) under {self.root}")
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def read_month(root, month: str, columns=None):
+    """One month partition as a pyarrow Table, read through memory-mapped files."""
+    _require()
+    part_dir = Path(root) / f"invoice_month={month}"
+    files = sorted(str(p) for p in part_dir.glob("*.parquet"))
+    if not files:
+        return to_table([]).select(columns) if columns else to_table([])
+    tables = [pq.read_table(f, columns=columns, memory_map=True) for f in files]
+    return pa.concat_tables(tables, promote_options="default")
+
+
+def convert_jsonl(jsonl_path, root, batch_rows=PARQUET_BATCH_ROWS) -> int:
+    """Write every {"file", "output"} line of a results JSONL into the Parquet dataset."""
+    n = 0
+    with ColumnarSink(root, batch_rows) as sink, open(jsonl_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # torn last line of a crashed run
+            sink.add(entry.get("file"), entry.get("output") or {}, entry.get("sha256"))
+            n += 1
+    return n
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Typed Parquet copy of extraction results, partitioned by invoice month")
+    ap.add_argument("--out", required=True, help="dataset root directory")
+    ap.add_argument("--jsonl", help="results JSONL to convert (appends new part files)")
+    ap.add_argument("--month", help="YYYY-MM: print row count and totals per currency for that month")
+    args = ap.parse_args()
+
+    if args.jsonl:
+        print(f"✅ converted {convert_jsonl(args.jsonl, args.out)} results from {args.jsonl} into {args.out}")
+        if normalize_batch is not None:
+            print("[NORM]", normalize_batch.summary())
+    if args.month:
+        t = read_month(args.out, args.month, columns=["currency", "total_amount"])
+        print(f"{args.month}: {t.num_rows} invoices")
+        for row in t.group_by("currency").aggregate([("total_amount", "sum")]).to_pylist():
+            print(f"  {row['currency']}\t{row['total_amount_sum']}")
@@ -0,0 +1,59 @@
+"""
+Duplicate-invoice index: which attachment content (SHA-256) and which emails (Message-ID) are
+already in invoice_ai, checked right after download instead of at the final INSERT.
+
+Vendors resend the same PDF (reminders, "corrected" threads, forwards); before this the resent copy
+went through OCR and GPT and was only caught, if at all, by ON CONFLICT (file). Now:
+
+- known_messages(): Message-IDs already linked in email_invoices → the email is not even downloaded.
+- lookup(): attachment hashes already recorded → no OCR/GPT; the new email is just linked to the
+  existing invoice (and no second set of AP rows goes to Excel).
+- record(): called in the same transaction as the invoice insert, so the index never points at an
+  invoice that was rolled back.
+
+Table (created by ensure_table):
+  invoice_ai.invoice_attachments(sha256 PK, invoice_id → email_pipeline_invoices, file, message_id, created_at)
+"""
+
+
+def ensure_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS invoice_ai.invoice_attachments (
+            sha256     TEXT PRIMARY KEY,
+            invoice_id INTEGER NOT NULL REFERENCES invoice_ai.email_pipeline_invoices(id) ON DELETE CASCADE,
+            file       TEXT,
+            message_id TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )""")
+    cur.execute("CREATE INDEX IF NOT EXISTS invoice_attachments_message_id "
+                "ON invoice_ai.invoice_attachments (message_id)")
+
+
+def known_messages(cur, message_ids) -> set:
+    """The subset of message_ids that were already processed and linked to an invoice."""
+    ids = [m for m in set(message_ids) if m]
+    if not ids:
+        return set()
+    cur.execute("SELECT message_id FROM invoice_ai.email_invoices "
+                "WHERE message_id = ANY(%s) AND invoice_id IS NOT NULL", (ids,))
+    return {r[0] for r in cur.fetchall()}
+
+
+def lookup(cur, shas) -> dict:
+    """{sha256: (invoice_id, message_id it first arrived in)} for the hashes already indexed."""
+    shas = [s for s in set(shas) if s]
+    if not shas:
+        return {}
+    cur.execute("SELECT sha256, invoice_id, message_id FROM invoice_ai.invoice_attachments "
+                "WHERE sha256 = ANY(%s)", (shas,))
+    return {sha: (invoice_id, mid) for sha, invoice_id, mid in cur.fetchall()}
+
+
+def record(cur, sha256, invoice_id, file_name, message_id):
+    if not sha256:
+        return
+    cur.execute("""
+        INSERT INTO invoice_ai.invoice_attachments (sha256, invoice_id, file, message_id)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (sha256) DO NOTHING
+    """, (sha256, invoice_id, file_name, message_id))
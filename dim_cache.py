@@ -0,0 +1,109 @@
+"""
+Process-wide cache of dimension ids (vendors, accounts, purchase_orders) keyed by their unique key.
+
+Both the live ingest (get_or_create) and the bulk loader (pg_bulk) go through the same cache, so a
+vendor seen thousands of times costs one lookup instead of a DB round trip per invoice.
+
+- warm(cur) preloads the keys most referenced by invoices at startup.
+- Each table is an LRU bounded by DIM_CACHE_SIZE entries.
+- Only ids that are known to be committed go in: callers put() after their transaction commits,
+  and invalidate() keys whose id turned out to be stale (e.g. a FK violation after another worker
+  merged or deleted the row). Misses are resolved with an upsert, so racing inserts from other
+  workers converge on the same id.
+- summary() reports hit rates, i.e. how many DB round trips the cache saved.
+
+Env:
+  DIM_CACHE_SIZE=10000   # entries per table
+  DIM_CACHE_WARM=2000    # hottest keys per table preloaded by warm()
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+DIM_CACHE_SIZE = int(os.getenv("DIM_CACHE_SIZE", "10000"))
+DIM_CACHE_WARM = int(os.getenv("DIM_CACHE_WARM", "2000"))
+
+# table → (unique key column, FK column on the invoice tables)
+TABLES = {
+    "vendors":         ("name",      "vendor_id"),
+    "accounts":        ("number",    "account_id"),
+    "purchase_orders": ("po_number", "po_id"),
+}
+
+
+class DimensionCache:
+    def __init__(self, maxsize: int = DIM_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = {t: OrderedDict() for t in TABLES}
+        self.stats = {t: {"hits": 0, "misses": 0, "evictions": 0} for t in TABLES}
+        self._lock = threading.Lock()
+
+    def get(self, table, key):
+        """Cached id or None; a hit moves the key to the most-recently-used end."""
+        with self._lock:
+            entries = self._entries[table]
+            if key in entries:
+                entries.move_to_end(key)
+                self.stats[table]["hits"] += 1
+                return entries[key]
+            self.stats[table]["misses"] += 1
+            return None
+
+    def put(self, table, key, id_):
+        with self._lock:
+            entries = self._entries[table]
+            entries[key] = id_
+            entries.move_to_end(key)
+            while len(entries) > self.maxsize:
+                entries.popitem(last=False)
+                self.stats[table]["evictions"] += 1
+
+    def put_many(self, table, mapping: dict):
+        for key, id_ in mapping.items():
+            self.put(table, key, id_)
+
+    def invalidate(self, table, key=None):
+        """Forget one key (or the whole table when key is None)."""
+        with self._lock:
+            if key is None:
+                self._entries[table].clear()
+            else:
+                self._entries[table].pop(key, None)
+
+    def warm(self, cur, fact_table="email_pipeline_invoices", limit: int = DIM_CACHE_WARM):
+        """Preload the `limit` keys per table that the most invoices in invoice_ai.<fact_table> point to."""
+        for table, (key, fk) in TABLES.items():
+            cur.execute(f"""
+                SELECT d.{key}, d.id
+                FROM invoice_ai.{table} d
+                JOIN (SELECT {fk} AS id, COUNT(*) AS n
+                      FROM invoice_ai.{fact_table}
+                      GROUP BY {fk}
+                      ORDER BY n DESC
+                      LIMIT %s) hot ON hot.id = d.id
+                ORDER BY hot.n
+            """, (limit,))
+            rows = cur.fetchall()
+            for k, id_ in rows:  # hottest last → most recently used
+                self.put(table, k, id_)
+            print(f"[DIM] warmed {len(rows)} {table}")
+
+    def summary(self) -> str:
+        parts = []
+        for table, st in self.stats.items():
+            total = st["hits"] + st["misses"]
+            rate = (st["hits"] / total * 100) if total else 0.0
+            parts.append(f"{table}: {st['hits']}/{total} hits ({rate:.0f}%), {len(self._entries[table])} cached")
+        return "; ".join(parts)
+
+
+_cache = None
+
+
+def get_cache() -> DimensionCache:
+    """The shared cache for this process."""
+    global _cache
+    if _cache is None:
+        _cache = DimensionCache()
+    return _cache
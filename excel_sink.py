@@ -0,0 +1,240 @@
+"""
+AP Excel writer that keeps the workbook open across a batch of invoices.
+
+append_ap_rows_to_excel used to load_workbook → append 2 rows → save for every invoice, so each
+invoice paid for parsing and re-serializing the whole (growing) sheet. ExcelSink loads the
+workbook once, appends rows in memory and saves when EXCEL_FLUSH_ROWS rows are pending or
+EXCEL_FLUSH_SECONDS have passed since the last save (and always on flush()/close()).
+
+The header row is parsed once per workbook (keyed by path + mtime) into a RowTemplate: fixed
+columns pre-filled, dynamic slots pre-indexed, so building a row is a copy plus a few assignments.
+
+Saves go to a temp file + os.replace, so a crash mid-save never leaves a truncated workbook.
+If the file was changed on disk since we loaded it (someone edited it via OneDrive), it is
+reloaded and the pending rows are re-applied before saving, instead of overwriting their edit.
+
+Appends can carry a source (the ingest passes the message UID); flush() and append_invoices()
+return the sources whose rows were just saved, so the caller can checkpoint exactly what is on
+disk, whichever save (size/time threshold or end of pass) wrote it.
+
+Env:
+  EXCEL_FLUSH_ROWS=200
+  EXCEL_FLUSH_SECONDS=30
+"""
+
+import os
+import time
+import random
+from decimal import Decimal
+from datetime import datetime
+
+from openpyxl import load_workbook
+
+from normalize import normalize_date
+
+EXCEL_FLUSH_ROWS    = int(os.getenv("EXCEL_FLUSH_ROWS", "200"))
+EXCEL_FLUSH_SECONDS = float(os.getenv("EXCEL_FLUSH_SECONDS", "30"))
+
+
+def to_dec(x):
+    s = ("" if x is None else str(x)).replace(",", "").replace("$", "").strip()
+    try:
+        return Decimal(s) if s else Decimal("0")
+    except Exception:
+        return Decimal("0")
+
+
+# Header (lower-cased) → value for the columns that are the same on every row
+FIXED_VALUES = {
+    "supplier site": "JPY59",
+    "description": "",            # D stays empty only if header is "description"; D is blank in your file anyway
+    "pay group": "AP3828",
+    "entity": "2827",
+    "region": "510",
+    "expense account": "725",
+    "product": "1100",
+    "project": "0",
+    "intercompany": "0",
+    "future use": "0",
+    "n/a": "NO",
+}
+
+# Slot name → headers it fills
+DYNAMIC_SLOTS = {
+    "invoice_number":   ("invoice number",),
+    "supplier_number":  ("supplier number",),
+    "line_description": ("line description", "line desctiption"),
+    "function":         ("function",),
+    "type":             ("type",),
+    "amount":           ("amount",),
+    "invoice_date":     ("invoice date",),
+}
+
+
+class RowTemplate:
+    """
+    The header row compiled once: a base row with every fixed column already filled, plus the
+    column index of each dynamic slot. rows() is then a list copy and a few index assignments.
+    """
+
+    def __init__(self, headers, today: str):
+        pos = {str(h).strip().lower(): i for i, h in enumerate(headers)}
+        fixed = dict(FIXED_VALUES, **{"today's date": today})
+        self.base = [""] * len(headers)
+        for h_raw, idx in pos.items():
+            if h_raw in fixed:
+                self.base[idx] = fixed[h_raw]
+        self.slots = []
+        for slot, names in DYNAMIC_SLOTS.items():
+            for name in names:
+                if name in pos:
+                    self.slots.append((slot, pos[name]))
+
+    def rows(self, fields):
+        """The ITEM and TAX rows for one invoice."""
+        inv_no = (fields.get("Invoice Number") or "").strip()
+        total  = to_dec(fields.get("Total Amount"))
+        tax    = to_dec(fields.get("Tax Amount"))
+        values = {
+            "invoice_number":   inv_no,
+            "supplier_number":  (fields.get("Supplier Number") or f"333{random.randint(100,999)}").strip(),
+            "line_description": (fields.get("Line Description") or f"{fields.get('Vendor Name','Vendor')} — {inv_no}").strip(),
+            "function":         (fields.get("Function") or "9600").strip(),
+            "invoice_date":     normalize_date(fields.get("Invoice Date"), vendor=fields.get("Vendor Name")) or "",
+        }
+        out = []
+        for row_type, amount in (("ITEM", max(total - tax, Decimal("0"))), ("TAX", tax)):
+            values["type"], values["amount"] = row_type, float(amount)
+            row = self.base.copy()
+            for slot, idx in self.slots:
+                row[idx] = values[slot]
+            out.append(row)
+        return out
+
+
+_templates = {}
+
+
+def get_template(path, headers) -> RowTemplate:
+    """Compiled template for this workbook, cached by (path, mtime, today's date)."""
+    today = datetime.now().strftime("%m/%d/%y")
+    key = (path, os.path.getmtime(path), today)
+    if key not in _templates:
+        _templates.clear()  # older mtimes/dates are never asked for again
+        _templates[key] = RowTemplate(headers, today)
+    return _templates[key]
+
+
+def build_ap_rows(headers, fields, path=None):
+    """The ITEM and TAX rows for one invoice, laid out to match the header row."""
+    if path is None:
+        return RowTemplate(headers, datetime.now().strftime("%m/%d/%y")).rows(fields)
+    return get_template(path, headers).rows(fields)
+
+
+class ExcelSink:
+    """Append AP rows to one workbook, saving on a row-count/time threshold instead of per invoice."""
+
+    def __init__(self, path, flush_rows=EXCEL_FLUSH_ROWS, flush_seconds=EXCEL_FLUSH_SECONDS):
+        self.path = path
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.wb = None
+        self.ws = None
+        self.headers = None
+        self.template = None
+        self.template_day = None
+        self.mtime = None
+        self.pending = []            # rows appended since the last save
+        self.pending_sources = []    # source of each invoice in pending (None if not given)
+        self.last_flush = time.monotonic()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"Excel file not found: {self.path}")
+        self.wb = load_workbook(self.path)
+        self.ws = self.wb.active
+        self.headers = [(c.value or "") for c in next(self.ws.iter_rows(min_row=1, max_row=1))]
+        self.mtime = os.path.getmtime(self.path)
+        self.template = get_template(self.path, self.headers)
+        self.template_day = datetime.now().date()
+
+    def append_invoice(self, fields, source=None) -> list:
+        return self.append_invoices([fields], source)
+
+    def append_invoices(self, fields_list, source=None) -> list:
+        """Queue the rows of several invoices from one source; returns the sources saved by a flush, if any."""
+        if self.wb is None:
+            self._load()
+        if datetime.now().date() != self.template_day:  # "today's date" column rolled over
+            self.template = get_template(self.path, self.headers)
+            self.template_day = datetime.now().date()
+        for fields in fields_list:
+            for row in self.template.rows(fields):
+                self.ws.append(row)
+                self.pending.append(row)
+        self.pending_sources.append(source)
+        if (len(self.pending) >= self.flush_rows
+                or time.monotonic() - self.last_flush >= self.flush_seconds):
+            return self.flush()
+        return []
+
+    def flush(self) -> list:
+        """Save pending rows; returns the sources whose rows were saved."""
+        if not self.pending:
+            saved, self.pending_sources = self.pending_sources, []  # sources that queued no rows
+            return [s for s in saved if s is not None]
+        if os.path.getmtime(self.path) != self.mtime:
+            print("[EXCEL] workbook changed on disk, reloading before save:", self.path)
+            self._load()
+            for row in self.pending:
+                self.ws.append(row)
+        tmp = self.path + ".tmp.xlsx"
+        self.wb.save(tmp)
+        os.replace(tmp, self.path)
+        self.mtime = os.path.getmtime(self.path)
+        print(f"✅ wrote {len(self.pending)} rows to:", self.path)
+        saved = [s for s in self.pending_sources if s is not None]
+        self.pending = []
+        self.pending_sources = []
+        self.last_flush = time.monotonic()
+        return saved
+
+    def close(self):
+        self.flush()
+        self.wb = self.ws = None
+
+    def discard(self):
+        """Drop unsaved rows and the in-memory workbook (the source messages will be reprocessed)."""
+        self.pending = []
+        self.pending_sources = []
+        self.wb = self.ws = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+_sinks = {}
+
+
+def get_sink(path) -> ExcelSink:
+    """One long-lived sink per workbook path for this process."""
+    if path not in _sinks:
+        _sinks[path] = ExcelSink(path)
+    return _sinks[path]
+
+
+def flush_all() -> list:
+    """Save every sink; returns the sources whose rows were saved."""
+    saved = []
+    for sink in _sinks.values():
+        saved += sink.flush()
+    return saved
+
+
+def discard_all():
+    for sink in _sinks.values():
+        sink.discard()
@@ -0,0 +1,286 @@
+"""
+Batched IMAP intake: fetch messages a chunk of UIDs at a time and apply flag/move/delete to a
+whole set of UIDs at once, instead of one FETCH plus add_flags/copy/delete_messages per message.
+A backlog of hundreds of unread invoices takes a handful of round trips.
+
+Bodies are fetched with BODY.PEEK[] so a message that fails to process stays unread and is
+picked up again on the next pass. Moving uses MOVE (RFC 6851) when the server advertises it,
+otherwise COPY + \\Deleted (expunged at the end of the pass).
+
+Header-first: prefetch() asks only for ENVELOPE + BODYSTRUCTURE of a chunk, so the caller can drop
+disallowed senders and mail without PDF parts before anything large is downloaded. fetch_pdfs() then
+pulls just BODY.PEEK[HEADER] plus the PDF body sections of the messages that qualify; the header is
+parsed into an email.message.Message, so code reading Subject/From/Message-ID/Date keeps working.
+PDFs inside forwarded (message/rfc822) parts count; messages with no PDF part are never downloaded.
+Only messages whose BODYSTRUCTURE can't be read (pdf_parts None) fall back to a full BODY.PEEK[] fetch.
+PDF parts are handed back still encoded, as an iterable of chunks for attachment_store.store();
+parts bigger than IMAP_PART_CHUNK are streamed with partial fetches (BODY.PEEK[2]<offset.length>)
+so a 40 MB statement never sits in memory in one piece.
+
+Env:
+  IMAP_FETCH_CHUNK=25   # UIDs per FETCH
+  IMAP_PART_CHUNK=1048576  # encoded bytes per partial fetch of a large PDF part
+  IMAP_SSL=1            # 0 for a plain-text local IMAP stand-in (e.g. GreenMail/Dovecot in tests)
+"""
+
+import os
+import re
+import email
+import email.header
+import email.utils
+from collections import defaultdict
+from urllib.parse import unquote, unquote_to_bytes
+
+from imapclient import IMAPClient
+
+IMAP_FETCH_CHUNK = int(os.getenv("IMAP_FETCH_CHUNK", "25"))
+IMAP_SSL         = os.getenv("IMAP_SSL", "1") == "1"
+IMAP_PART_CHUNK  = int(os.getenv("IMAP_PART_CHUNK", str(1024 * 1024)))
+
+
+def chunked(uids, size=IMAP_FETCH_CHUNK):
+    uids = list(uids)
+    for i in range(0, len(uids), size):
+        yield uids[i:i + size]
+
+
+def fetch_messages(server: IMAPClient, uids):
+    """Yield (uid, parsed message) for one chunk of UIDs with a single FETCH."""
+    if not uids:
+        return
+    resp = server.fetch(uids, ["BODY.PEEK[]"])
+    for uid in uids:
+        data = resp.get(uid)
+        if not data or b"BODY[]" not in data:
+            print(f"⚠️ UID {uid} vanished before fetch")
+            continue
+        yield uid, email.message_from_bytes(data[b"BODY[]"])
+
+
+def finish_messages(server: IMAPClient, uids, folder: str):
+    """Mark read + move to folder for a whole batch of UIDs (no-op for an empty batch)."""
+    uids = list(uids)
+    if not uids:
+        return
+    server.add_flags(uids, [b"\\Seen"])
+    if server.has_capability("MOVE"):
+        server.move(uids, folder)
+    else:
+        server.copy(uids, folder)
+        server.delete_messages(uids)  # expunged by the caller at the end of the pass
+    print(f"📦 moved {len(uids)} message(s) to {folder}")
+
+
+# ---------- header-first prefetch ----------
+
+class PdfPart:
+    """One PDF body section as described by BODYSTRUCTURE."""
+    def __init__(self, section, filename, encoding, size):
+        self.section = section      # e.g. "2" or "1.3"
+        self.filename = filename
+        self.encoding = encoding    # content-transfer-encoding, lower-case
+        self.size = size
+
+    def __repr__(self):
+        return f"PdfPart({self.section}, {self.filename!r}, {self.size}B)"
+
+
+class MailSummary:
+    """What prefetch() learned about a message without downloading it."""
+    def __init__(self, uid, sender, subject, pdf_parts, message_id=""):
+        self.uid = uid
+        self.sender = sender        # "user@domain", for sender_allowed()
+        self.subject = subject
+        self.message_id = message_id
+        self.pdf_parts = pdf_parts  # list of PdfPart, or None if BODYSTRUCTURE was unreadable
+
+
+def _s(v):
+    return v.decode(errors="replace") if isinstance(v, bytes) else ("" if v is None else str(v))
+
+
+def _decode_words(v):
+    try:
+        return str(email.header.make_header(email.header.decode_header(_s(v))))
+    except Exception:
+        return _s(v)
+
+
+_CONTINUATION = re.compile(r"^(.+?)\*(\d+)(\*?)$")  # filename*0*, filename*1, …
+
+
+def _join_continuations(segments):
+    """RFC 2231 continuation segments {n: (encoded, value)} → one decoded value."""
+    charset, raw = "utf-8", b""
+    for n in sorted(segments):
+        encoded, v = segments[n]
+        if encoded:
+            if n == 0 and v.count("'") >= 2:
+                cs, _lang, v = v.split("'", 2)
+                charset = cs or charset
+            raw += unquote_to_bytes(v)
+        else:
+            raw += v.encode("utf-8")
+    try:
+        return raw.decode(charset, errors="replace")
+    except LookupError:
+        return raw.decode("utf-8", errors="replace")
+
+
+def _params(seq):
+    """BODYSTRUCTURE (k1 v1 k2 v2 …) → {k: v}; RFC 2231 filename* values and continuations are decoded."""
+    out, continued = {}, defaultdict(dict)
+    if not isinstance(seq, (tuple, list)):
+        return out
+    for k, v in zip(seq[0::2], seq[1::2]):
+        k = _s(k).lower()
+        v = _s(v)
+        m = _CONTINUATION.match(k)
+        if m:
+            continued[m.group(1)][int(m.group(2))] = (bool(m.group(3)), v)
+            continue
+        if k.endswith("*"):
+            k = k.rstrip("*")
+            charset, _lang, text = email.utils.decode_rfc2231(v)
+            v = unquote(text, encoding=charset or "utf-8", errors="replace")
+        out[k] = _decode_words(v)
+    for k, segments in continued.items():
+        out[k] = _decode_words(_join_continuations(segments))
+    return out
+
+
+def _disposition(part, maintype):
+    """(disposition, params) from a single-part BODYSTRUCTURE; its index depends on the part type."""
+    # basic fields: type subtype params id description encoding size = 7;
+    # text/* adds lines, message/rfc822 adds envelope + body + lines; then md5, disposition
+    idx = {"text": 9, "message": 11}.get(maintype, 8)
+    if len(part) > idx and isinstance(part[idx], (tuple, list)) and part[idx]:
+        return _s(part[idx][0]).lower(), _params(part[idx][1] if len(part[idx]) > 1 else ())
+    return "", {}
+
+
+def pdf_parts(bodystructure, prefix=""):
+    """
+    Every PDF section in a BODYSTRUCTURE: application/pdf, or an attachment named *.pdf. Emails
+    forwarded as attachments (message/rfc822) are searched too; their parts are numbered under the
+    attachment's section (2.1, 2.2, … or 2.1 for a single-part body). Unnamed PDFs get a default name.
+    """
+    found = []
+    if isinstance(bodystructure[0], list):  # multipart: ([children], subtype, …)
+        for n, child in enumerate(bodystructure[0], 1):
+            found += pdf_parts(child, f"{prefix}{n}.")
+        return found
+    maintype, subtype = _s(bodystructure[0]).lower(), _s(bodystructure[1]).lower()
+    section = prefix.rstrip(".") or "1"
+    if (maintype, subtype) == ("message", "rfc822") and len(bodystructure) > 8 \
+            and isinstance(bodystructure[8], (tuple, list)) and bodystructure[8]:
+        inner = bodystructure[8]  # type subtype params id description encoding size ENVELOPE BODY lines
+        return pdf_parts(inner, f"{section}." if isinstance(inner[0], list) else f"{section}.1.")
+    disp, dparams = _disposition(bodystructure, maintype)
+    fname = dparams.get("filename") or _params(bodystructure[2]).get("name") or ""
+    is_pdf = (maintype, subtype) == ("application", "pdf") or (
+        disp == "attachment" and fname.lower().endswith(".pdf"))
+    if is_pdf:
+        found.append(PdfPart(section, fname or f"attachment-{section}.pdf",
+                             _s(bodystructure[5]).lower(), int(bodystructure[6] or 0)))
+    return found
+
+
+def prefetch(server: IMAPClient, uids):
+    """ENVELOPE + BODYSTRUCTURE for a chunk of UIDs (a few hundred bytes per message)."""
+    if not uids:
+        return []
+    resp = server.fetch(uids, ["ENVELOPE", "BODYSTRUCTURE"])
+    out = []
+    for uid in uids:
+        data = resp.get(uid)
+        if not data:
+            print(f"⚠️ UID {uid} vanished before fetch")
+            continue
+        env = data.get(b"ENVELOPE")
+        sender, subject, message_id = "", "", ""
+        if env is not None:
+            subject = _decode_words(env.subject)
+            message_id = _s(env.message_id).strip()
+            if env.from_:
+                a = env.from_[0]
+                sender = f"{_s(a.mailbox)}@{_s(a.host)}"
+        try:
+            parts = pdf_parts(data[b"BODYSTRUCTURE"])
+        except Exception as e:
+            print(f"⚠️ UID {uid}: unreadable BODYSTRUCTURE ({e}), will fetch the full message")
+            parts = None
+        out.append(MailSummary(uid, sender, subject, parts, message_id))
+    return out
+
+
+def header_bytes(msg) -> bytes:
+    """Just the header block of a parsed message (for storing alongside a checkpoint)."""
+    return "".join(f"{k}: {v}\r\n" for k, v in msg.items()).encode("utf-8", "surrogateescape")
+
+
+def _walk_pdfs(msg):
+    """(filename, encoding, chunks) of the PDF attachments of a fully fetched message (fallback path)."""
+    found = []
+    for n, part in enumerate(msg.walk(), 1):  # walk() also descends into forwarded message/rfc822 parts
+        fname = part.get_filename() or ""
+        named_pdf = fname.lower().endswith(".pdf") and "attachment" in part.get("Content-Disposition", "")
+        if part.get_content_type() != "application/pdf" and not named_pdf:
+            continue
+        payload = part.get_payload(decode=True)
+        if payload:
+            found.append((fname or f"attachment-{n}.pdf", "binary", [payload]))
+    return found
+
+
+def _part_chunks(server: IMAPClient, uid, part: PdfPart):
+    """Encoded body of one large part, IMAP_PART_CHUNK bytes per round trip."""
+    offset = 0
+    while True:
+        resp = server.fetch([uid], [f"BODY.PEEK[{part.section}]<{offset}.{IMAP_PART_CHUNK}>"])
+        data = resp.get(uid) or {}
+        chunk = next((v for k, v in data.items() if k.startswith(b"BODY[")), None)
+        if not chunk:
+            return
+        yield chunk
+        offset += len(chunk)
+        if len(chunk) < IMAP_PART_CHUNK:
+            return
+
+
+def fetch_pdfs(server: IMAPClient, summaries):
+    """
+    Yield (uid, header message, [(filename, encoding, chunks)]) for the summaries that passed filtering.
+    One FETCH per distinct set of (small) PDF sections, usually just section 2; large parts are streamed
+    when their chunks are consumed, so consume each item before asking for the next. BODY.PEEK, so
+    nothing is marked read; messages without a usable BODYSTRUCTURE are fetched in full.
+    """
+    groups = defaultdict(list)
+    full = []
+    for s in summaries:
+        if s.pdf_parts is None:
+            full.append(s.uid)
+        else:
+            groups[tuple(p.section for p in s.pdf_parts if p.size <= IMAP_PART_CHUNK)].append(s)
+
+    for sections, group in groups.items():
+        items = ["BODY.PEEK[HEADER]"] + [f"BODY.PEEK[{sec}]" for sec in sections]
+        resp = server.fetch([s.uid for s in group], items)
+        for s in group:
+            data = resp.get(s.uid)
+            if not data:
+                print(f"⚠️ UID {s.uid} vanished before fetch")
+                continue
+            msg = email.message_from_bytes(data.get(b"BODY[HEADER]") or b"")
+            pdfs = []
+            for p in s.pdf_parts:
+                if p.section in sections:
+                    raw = data.get(f"BODY[{p.section}]".encode())
+                    if raw:
+                        pdfs.append((p.filename, p.encoding, [raw]))
+                else:
+                    pdfs.append((p.filename, p.encoding, _part_chunks(server, s.uid, p)))
+            yield s.uid, msg, pdfs
+
+    for uid, msg in fetch_messages(server, full):
+        yield uid, msg, _walk_pdfs(msg)
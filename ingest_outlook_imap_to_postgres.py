@@ -23,14 +23,13 @@ Prereqs (venv active):
 """
 
 import os
-import io
 import json
+import time
+import asyncio
+import argparse
 import email
-import hashlib
-import pathlib
 import traceback
 import email.utils
-from datetime import datetime, timezone
 
 
 from pathlib import Path
@@ -40,8 +39,6 @@ env_path = Path(__file__).resolve().parent / ".env"
 print("Looking for .env at:", env_path)
 load_dotenv(dotenv_path=env_path)
 
-import os
-
 BASE_DIR = Path(__file__).resolve().parent
 load_dotenv(BASE_DIR / ".env")  # always load .env next to this script
 
@@ -52,45 +49,21 @@ print("ENV check OPENAI_API_KEY present:", bool(os.getenv("OPENAI_API_KEY")))
 from imapclient import IMAPClient
 import psycopg2
 
-from pdf2image import convert_from_path
-import pytesseract
-from openai import OpenAI
-
-import re
-from dateutil import parser as dateparser
+from ocr import extract_texts
+from llm_extract import (
+    extract_fields_async, get_client, background_loop, LLM_CONCURRENCY,
+)
+from pg_bulk import ensure_unique_keys, upsert_dimension
+from dim_cache import get_cache
+from pg_pool import unit_of_work
+from excel_sink import get_sink, flush_all, discard_all
+from pipeline import Pipeline, Stage, Failed
+from imap_intake import chunked, prefetch, fetch_pdfs, finish_messages, header_bytes, IMAP_SSL
+from mail_checkpoint import MailboxCheckpoint, RANK
+import attachment_store
+import dedup_index
 
-def as_date(s):
-    if not s or not str(s).strip():
-        return None
-    try:
-        return dateparser.parse(str(s)).date()
-    except Exception:
-        return None
-
-def as_decimal(s):
-    if s is None:
-        return None
-    if isinstance(s, (int, float)):
-        return float(s)
-    s = str(s).replace(",", "")
-    m = re.search(r"([-+]?\d+(\.\d+)?)", s)
-    return float(m.group(1)) if m else None
-
-def derive_currency(amount_str, explicit_currency):
-    if explicit_currency and explicit_currency.strip():
-        return explicit_currency.strip().upper()
-    if not amount_str:
-        return None
-    txt = str(amount_str)
-    if "$" in txt: return "USD"
-    if "€" in txt: return "EUR"
-    if "£" in txt: return "GBP"
-    if "₹" in txt: return "INR"
-    if "C$" in txt: return "CAD"
-    if "A$" in txt: return "AUD"
-    # fallback if someone passes a code like usd/cad
-    c = txt.strip().upper()
-    return c if len(c) == 3 else None
+from normalize import as_date, as_decimal, derive_currency
 
 
 # --------------------------- Config / env ---------------------------
@@ -106,7 +79,7 @@ GMAIL_APP_PASSWORD = os.getenv("GMAIL_APP_PASSWORD")
 # OpenAI
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-# Postgres
+# Postgres (connections come from pg_pool, which reads the same env vars)
 PG_DB       = os.getenv("PG_DB", "invoice_db")
 PG_USER     = os.getenv("PG_USER", "postgres")
 PG_PASSWORD = os.getenv("PG_PASSWORD", "")
@@ -117,7 +90,7 @@ PG_PORT     = os.getenv("PG_PORT", "5432")
 ALLOWED_SENDERS = [d.strip().lower() for d in os.getenv("ALLOWED_SENDERS","").split(",") if d.strip()]
 
 # Local download folder for PDFs
-DOWNLOAD_DIR = pathlib.Path("inbox_downloads"); DOWNLOAD_DIR.mkdir(exist_ok=True)
+DOWNLOAD_DIR = attachment_store.DOWNLOAD_DIR  # <sha[:2]>/<sha>.pdf, created by setup()
 PROCESSED_FOLDER = "Processed"  # IMAP folder to move processed emails
 
 # Validate critical env
@@ -126,56 +99,68 @@ def require(name, value):
         raise ValueError(f"❌ Missing required env var: {name}. Check your .env.")
     return value
 
-require("GMAIL_EMAIL", GMAIL_EMAIL)
-require("GMAIL_APP_PASSWORD", GMAIL_APP_PASSWORD)
-require("OPENAI_API_KEY", OPENAI_API_KEY)
+_ready = False
 
-print("✅ ENV: OPENAI_API_KEY loaded:", bool(OPENAI_API_KEY))
-print("✅ ENV: GMAIL_EMAIL:", GMAIL_EMAIL)
-print("✅ ENV: IMAP host/port:", IMAP_HOST, IMAP_PORT)
-
-# Initialize OpenAI client
-client = OpenAI(api_key=OPENAI_API_KEY)
+def setup():
+    """
+    Env checks, OpenAI client, DDL and cache warm-up. Not done at import: OCR worker processes
+    started with spawn re-import __main__, and each would otherwise connect and run the DDL again.
+    Safe to call more than once.
+    """
+    global _ready
+    if _ready:
+        return
+    require("GMAIL_EMAIL", GMAIL_EMAIL)
+    require("GMAIL_APP_PASSWORD", GMAIL_APP_PASSWORD)
+    require("OPENAI_API_KEY", OPENAI_API_KEY)
+
+    print("✅ ENV: OPENAI_API_KEY loaded:", bool(OPENAI_API_KEY))
+    print("✅ ENV: GMAIL_EMAIL:", GMAIL_EMAIL)
+    print("✅ ENV: IMAP host/port:", IMAP_HOST, IMAP_PORT)
+
+    if not os.path.exists(XLSX_PATH):
+        raise SystemExit(f"File not found: {XLSX_PATH}")
+    DOWNLOAD_DIR.mkdir(exist_ok=True)
+
+    # Initialize the shared OpenAI client (one keep-alive connection pool for the whole process)
+    get_client()
+
+    # Pooled connections; each email is written in one transaction (see pg_pool.unit_of_work)
+    with unit_of_work() as cur:
+        ensure_unique_keys(cur)      # ON CONFLICT targets for the dimension upserts
+        dedup_index.ensure_table(cur)  # attachment SHA-256 → invoice, checked before OCR
+        dims.warm(cur)               # hottest vendors/accounts/POs → no round trip for them
+    _ready = True
 
 # --------------------------- Postgres helpers ---------------------------
 
-conn = psycopg2.connect(
-    dbname=PG_DB, user=PG_USER, password=PG_PASSWORD, host=PG_HOST, port=PG_PORT
-)
-conn.autocommit = True
-cur = conn.cursor()
-
-def get_or_create(table, unique_key, data_dict):
-    """Upsert-like helper that returns the row id for vendors/accounts/POs."""
-    cols = list(data_dict.keys())
-    vals = [data_dict[c] for c in cols]
+dims = get_cache()
 
-    # Try to find existing by unique_key
-    sel_sql = f"SELECT id FROM invoice_ai.{table} WHERE {unique_key} = %s LIMIT 1"
-    cur.execute(sel_sql, (data_dict[unique_key],))
-    row = cur.fetchone()
-    if row:
-        return row[0]
+def get_or_create(cur, table, unique_key, data_dict):
+    """Return the row id for vendors/accounts/POs: shared dimension cache first, one upsert on a miss."""
+    data_dict = dict(data_dict, **{unique_key: data_dict.get(unique_key) or ""})
+    key = data_dict[unique_key]
+    cached = dims.get(table, key)
+    if cached is not None:
+        return cached
 
-    # Insert and return id
-    placeholders = ",".join(["%s"]*len(cols))
-    colnames = ",".join(cols)
-    ins_sql = f"INSERT INTO invoice_ai.{table} ({colnames}) VALUES ({placeholders}) RETURNING id"
-    cur.execute(ins_sql, vals)
-    return cur.fetchone()[0]
+    # INSERT … ON CONFLICT … RETURNING: one round trip, and a racing worker's insert resolves to the same id
+    id_ = upsert_dimension(cur, table, [data_dict])[key]
+    cur.after_commit(lambda: dims.put(table, key, id_))  # only share ids that actually committed
+    return id_
 
-def insert_invoice_email_pipeline(file_name, out) -> int:
-    """Insert into invoice_ai.email_pipeline_invoices and return invoice_id."""
-    vendor_id = get_or_create("vendors", "name", {
+def insert_invoice_email_pipeline(cur, file_name, out, _retry=True) -> int:
+    """Insert into invoice_ai.email_pipeline_invoices and return invoice_id (caller owns the transaction)."""
+    vendor_id = get_or_create(cur, "vendors", "name", {
         "name": out.get("Vendor Name",""),
         "address": out.get("Vendor Address","")
     })
-    account_id = get_or_create("accounts", "number", {
+    account_id = get_or_create(cur, "accounts", "number", {
         "number":  out.get("Account Number",""),
         "name":    out.get("Account Name",""),
         "manager": out.get("Account Manager","")
     })
-    po_id = get_or_create("purchase_orders", "po_number", {
+    po_id = get_or_create(cur, "purchase_orders", "po_number", {
         "po_number":      out.get("PO Number",""),
         "billing_period": out.get("Billing Period",""),
         "tax_code":       out.get("Tax Code",""),
@@ -183,8 +168,9 @@ def insert_invoice_email_pipeline(file_name, out) -> int:
     })
 
     # ⇩ sanitize/normalize fields
-    invoice_date = as_date(out.get("Invoice Date"))
-    due_date     = as_date(out.get("Due Date"))
+    vendor       = out.get("Vendor Name")
+    invoice_date = as_date(out.get("Invoice Date"), vendor=vendor)
+    due_date     = as_date(out.get("Due Date"), vendor=vendor)
     total_amount = as_decimal(out.get("Total Amount"))
     currency     = derive_currency(out.get("Total Amount"), out.get("Currency"))
 
@@ -205,7 +191,18 @@ def insert_invoice_email_pipeline(file_name, out) -> int:
         total_amount,            # numeric (float) or NULL
         vendor_id, account_id, po_id
     )
-    cur.execute(sql, data)
+    cur.execute("SAVEPOINT invoice_insert")
+    try:
+        cur.execute(sql, data)
+    except psycopg2.errors.ForeignKeyViolation:
+        if not _retry:
+            raise
+        # a cached dimension id is stale (row merged/deleted by another worker): forget it and retry once
+        cur.execute("ROLLBACK TO SAVEPOINT invoice_insert")
+        dims.invalidate("vendors", out.get("Vendor Name") or "")
+        dims.invalidate("accounts", out.get("Account Number") or "")
+        dims.invalidate("purchase_orders", out.get("PO Number") or "")
+        return insert_invoice_email_pipeline(cur, file_name, out, _retry=False)
     row = cur.fetchone()
     if row:
         return row[0]
@@ -214,7 +211,7 @@ def insert_invoice_email_pipeline(file_name, out) -> int:
 
 
 
-def insert_email_invoice(invoice_id: int, file_name: str, msg):
+def insert_email_invoice(cur, invoice_id: int, file_name: str, msg):
     """Upsert email metadata and link to email_pipeline_invoices(invoice_id)."""
     subject = msg.get("Subject", "")
     sender  = msg.get("From", "")
@@ -237,133 +234,6 @@ def insert_email_invoice(invoice_id: int, file_name: str, msg):
     """, (mid, subject, sender, dt, invoice_id))
 
 
-# --------------------------- OCR ---------------------------
-
-def extract_text_from_pdf(pdf_path: str) -> str:
-    """Convert all pages to images, OCR with Tesseract, return concatenated text."""
-    images = convert_from_path(pdf_path)
-    text = ""
-    for img in images:
-        text += pytesseract.image_to_string(img)
-    return text
-
-# --------------------------- GPT ---------------------------
-
-def extract_fields_with_gpt(text: str) -> dict:
-    """
-    Use GPT to extract a rich set of invoice fields.
-    Returns strict JSON with predictable keys and normalized formats.
-    """
-    from openai import OpenAI
-    import json, re
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-    system = (
-        "You are an information extraction service for invoices. "
-        "Return STRICT JSON only (no prose). Use null for unknowns."
-    )
-
-    user = f"""
-Extract the following fields from the invoice text.
-Return a SINGLE JSON object with EXACT keys and the following constraints:
-
-Keys (exact spelling):
-- "Invoice Number": string
-- "Invoice Date": string (YYYY-MM-DD if possible)
-- "Due Date": string (YYYY-MM-DD or null)
-- "Vendor Name": string or null
-- "Vendor Address": string or null
-- "PO Number": string or null
-- "Billing Period": string or null
-- "Account Number": string or null
-- "Account Name": string or null
-- "Account Manager": string or null
-- "Tax Code": string or null
-- "Subtotal": string or null                # numeric string, e.g., "680.00"
-- "Tax Amount": string or null              # numeric string, e.g., "34.00"
-- "Currency": string or null                # ISO code if obvious (USD, CAD, GBP, EUR, INR)
-- "Total Amount": string                    # numeric string, required
-- "Line Description": string or null        # short human label for this invoice (vendor + invno)
-
-Normalization rules:
-- Dates: prefer ISO YYYY-MM-DD if you can infer; else keep as seen.
-- Amounts: output ONLY digits and a decimal point (strip currency symbols and commas).
-- Currency: output a code like USD/CAD/INR/GBP/EUR if present or clearly implied; else null.
-- If a field truly does not appear, set it to null.
-
-Example output:
-{{
-  "Invoice Number": "INV-101905",
-  "Invoice Date": "2025-08-05",
-  "Due Date": "2025-08-24",
-  "Vendor Name": "Scott Inc",
-  "Vendor Address": "123 Example St, Toronto, ON",
-  "PO Number": "PO-77831",
-  "Billing Period": "2025-07",
-  "Account Number": "5850133469",
-  "Account Name": "Innovate Wireless Partnerships",
-  "Account Manager": "Cody Burke",
-  "Tax Code": "VAT-20%",
-  "Subtotal": "680.00",
-  "Tax Amount": "34.00",
-  "Currency": "CAD",
-  "Total Amount": "714.00",
-  "Line Description": "Scott Inc — INV-101905"
-}}
-
-INVOICE TEXT:
-\"\"\"{text}\"\"\"
-"""
-
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",  # or "gpt-4.1-mini" if you have access
-        temperature=0,
-        messages=[
-            {"role": "system", "content": system},
-            {"role": "user",   "content": user},
-        ],
-    )
-    raw = resp.choices[0].message.content.strip()
-
-    # Be tolerant to ```json fences
-    raw = raw.strip()
-    if raw.startswith("```"):
-        raw = re.sub(r"^```(?:json)?\s*|\s*```$", "", raw, flags=re.IGNORECASE | re.DOTALL)
-
-    try:
-        data = json.loads(raw)
-    except Exception:
-        # last-ditch: try to locate the first {...}
-        m = re.search(r"\{.*\}", raw, flags=re.DOTALL)
-        data = json.loads(m.group(0)) if m else {}
-
-    # post-normalize numeric strings (strip $ and commas just in case)
-    def clean_amt(v):
-        if v is None: return None
-        s = str(v).replace("$","").replace(",","").strip()
-        # allow bare numbers only
-        return s
-
-    for k in ["Subtotal", "Tax Amount", "Total Amount"]:
-        if k in data:
-            data[k] = clean_amt(data[k])
-
-    # ensure required keys exist even if null
-    required = ["Invoice Number","Invoice Date","Due Date","Vendor Name","Vendor Address",
-                "PO Number","Billing Period","Account Number","Account Name","Account Manager",
-                "Tax Code","Subtotal","Tax Amount","Currency","Total Amount","Line Description"]
-    for k in required:
-        data.setdefault(k, None)
-
-    # sensible fallback for Line Description
-    if not data.get("Line Description"):
-        vn = (data.get("Vendor Name") or "Vendor").strip()
-        ino = (data.get("Invoice Number") or "").strip()
-        data["Line Description"] = f"{vn} — {ino}".strip(" —")
-
-    return data
-
-
 # --------------------------- IMAP helpers ---------------------------
 
 def ensure_folder(server: IMAPClient, folder: str):
@@ -381,31 +251,28 @@ def sender_allowed(from_header: str) -> bool:
     except:
         return True
 
-def save_pdf_attachments(msg):
-    """Save PDF attachments to DOWNLOAD_DIR, return list of saved file paths."""
+def save_pdf_attachments(attachments):
+    """
+    Stream (filename, encoding, chunks) PDF attachments into the content-addressed store.
+    Returns one {"path", "file", "sha"} per PDF; "file" is the name recorded in Postgres.
+    """
     saved = []
-    if msg.is_multipart():
-        for part in msg.walk():
-            cdisp = part.get("Content-Disposition", "")
-            if "attachment" in cdisp:
-                fname = part.get_filename()
-                if not fname:
-                    continue
-                if not fname.lower().endswith(".pdf"):
-                    continue
-                payload = part.get_payload(decode=True)
-                if not payload:
-                    continue
-                path = DOWNLOAD_DIR / fname
-                if path.exists():
-                    ts = datetime.now().strftime("%Y%m%d%H%M%S")
-                    path = DOWNLOAD_DIR / f"{ts}_{fname}"
-                with open(path, "wb") as f:
-                    f.write(payload)
-                saved.append(str(path))
+    for fname, encoding, chunks in attachments:
+        att = attachment_store.store(chunks, encoding, fname)
+        if att is None:
+            continue
+        if att.duplicate:
+            print(f"[STORE] {fname} already stored as {os.path.basename(att.path)}")
+        saved.append({"path": att.path, "file": att.file_name, "sha": att.sha256})
     return saved
 
-from openpyxl import Workbook, load_workbook
+def as_attachment(p):
+    """Checkpoint rows written before the content-addressed store hold plain paths."""
+    if isinstance(p, str):
+        return {"path": p, "file": os.path.basename(p), "sha": None}
+    return p
+
+from openpyxl import Workbook
 
 AP_XLSX_COLS = [
     "Invoice number", "Supplier number", "Supplier site", "Description",
@@ -436,183 +303,331 @@ def ensure_ap_workbook(path):
         ws.append(AP_XLSX_COLS)
         wb.save(path)
 
-from openpyxl import load_workbook
-from decimal import Decimal
-from datetime import datetime
-import random
-
-from openpyxl import load_workbook
-from decimal import Decimal
-from datetime import datetime
-import os, random
-
-from datetime import datetime
-
-def normalize_date(s: str) -> str:
-    if not s: 
-        return ""
-    s = s.strip()
-    fmts = [
-        "%Y-%m-%d", "%Y/%m/%d",                # 2025-09-10
-        "%m-%d-%Y", "%m/%d/%Y",                # 09-10-2025
-        "%d-%m-%Y", "%d/%m/%Y",                # 10-09-2025
-        "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S"
-    ]
-    for f in fmts:
-        try:
-            dt = datetime.strptime(s, f)
-            return dt.strftime("%m/%d/%y")     # Excel-friendly format
-        except Exception:
-            pass
-    return s  # if it’s some other readable format, keep as-is
-
-
 XLSX_PATH = "/Users/adityasmacbookair/Documents/Invoice Automation Project/test book.xlsx"
 
-def append_ap_rows_to_excel(xlsx_path, fields):
-    wb = load_workbook(xlsx_path)
-    ws = wb.active
-
-    headers = [(c.value or "") for c in next(ws.iter_rows(min_row=1, max_row=1))]
-    pos = {str(h).strip().lower(): i for i, h in enumerate(headers)}
-
-    def to_dec(x):
-        s = ("" if x is None else str(x)).replace(",", "").replace("$", "").strip()
-        try:
-            return Decimal(s) if s else Decimal("0")
-        except Exception:
-            return Decimal("0")
-
-    inv_no    = (fields.get("Invoice Number") or "").strip()
-    supp_no   = (fields.get("Supplier Number") or f"333{random.randint(100,999)}").strip()
-    line_desc = (fields.get("Line Description") or f"{fields.get('Vendor Name','Vendor')} — {inv_no}").strip()
-    func_val  = (fields.get("Function") or "9600").strip()
-    total     = to_dec(fields.get("Total Amount"))
-    tax       = to_dec(fields.get("Tax Amount"))
-    item      = max(total - tax, Decimal("0"))
-    inv_date_norm = normalize_date(fields.get("Invoice Date"))
-    fixed = {
-        "invoice date": inv_date_norm or "",       # <-- use extracted invoice date,
-        "supplier site": "JPY59",
-        "description": "",            # D stays empty only if header is "description"; D is blank in your file anyway
-        "pay group": "AP3828",
-        "today's date": datetime.now().strftime("%m/%d/%y"),
-        "entity": "2827",
-        "region": "510",
-        "expense account": "725",
-        "product": "1100",
-        "project": "0",
-        "intercompany": "0",
-        "future use": "0",
-        "n/a": "NO",
-    }
-
-    def build_row(row_type, amount):
-        row = [""] * len(headers)
-        for h_raw, idx in pos.items():
-            # keep any blank/None header columns empty (covers D, I, etc.)
-            if h_raw in ("", "none"):
-                row[idx] = ""
-                continue
-
-            # dynamic fields
-            if h_raw == "invoice number":           row[idx] = inv_no
-            elif h_raw == "supplier number":        row[idx] = supp_no
-            elif h_raw in ("line description","line desctiption"):
-                                                    row[idx] = line_desc
-            elif h_raw == "function":               row[idx] = func_val
-            elif h_raw == "type":                   row[idx] = row_type
-            elif h_raw == "amount":                 row[idx] = float(amount)
-            # fixed named headers
-            elif h_raw in fixed:                    row[idx] = fixed[h_raw]
-            else:                                   row[idx] = ""     # anything unknown stays empty
-        return row
-
-    ws.append(build_row("ITEM", item))
-    ws.append(build_row("TAX",  tax))
-    wb.save(xlsx_path)
-    print("✅ wrote 2 rows to:", xlsx_path)
-
-
-
-if not os.path.exists(XLSX_PATH):
-    raise SystemExit(f"File not found: {XLSX_PATH}")
+def append_ap_rows_to_excel(xlsx_path, fields_list, uid):
+    """
+    Queue the ITEM + TAX rows of one email; the workbook stays open and is saved in batches
+    (see excel_sink.py). Returns the UIDs whose rows a save triggered by this call wrote.
+    """
+    return get_sink(xlsx_path).append_invoices(fields_list, source=uid)
 
 # --------------------------- Main ---------------------------
 
-def main():
-    print("Connecting to IMAP…")
-    with IMAPClient(IMAP_HOST, port=IMAP_PORT, use_uid=True, ssl=True) as server:
-        server.login(GMAIL_EMAIL, GMAIL_APP_PASSWORD)
-        label = os.getenv("GMAIL_LABEL", "INBOX")
-        server.select_folder(label)
-        print("Using label:", label)
-        print("Unread count:", len(server.search("UNSEEN")))
-        ensure_folder(server, PROCESSED_FOLDER)
-
-        # Fetch unread messages
-        uids = server.search("UNSEEN")
-        if not uids:
-            print("No unread messages.")
-            return
+# Daemon mode (--daemon): keep one IMAP session open and wait with IDLE
+IDLE_TIMEOUT  = int(os.getenv("IMAP_IDLE_TIMEOUT", "60"))        # seconds per idle_check
+IDLE_RENEW    = int(os.getenv("IMAP_IDLE_RENEW", str(25 * 60)))  # re-issue IDLE before the 29 min server cutoff
+RECONNECT_MAX = int(os.getenv("IMAP_RECONNECT_MAX", "300"))      # cap for reconnect backoff (seconds)
 
-        for uid in uids:
-            try:
-                raw = server.fetch(uid, ["RFC822"])[uid][b"RFC822"]
-                msg = email.message_from_bytes(raw)
-
-                from_header = msg.get("From","")
-                subject = msg.get("Subject","")
-                if not sender_allowed(from_header):
-                    print(f"Skipping sender: {from_header}")
-                    server.add_flags(uid, [b"\\Seen"])
-                    server.copy(uid, PROCESSED_FOLDER)
-                    server.delete_messages(uid)
-                    continue
+MAILBOX = os.getenv("GMAIL_LABEL", "INBOX")
 
-                pdfs = save_pdf_attachments(msg)
-                if not pdfs:
-                    print(f"No PDF attachments in: {subject}")
-                    server.add_flags(uid, [b"\\Seen"])
-                    server.copy(uid, PROCESSED_FOLDER)
-                    server.delete_messages(uid)
+def connect_imap() -> IMAPClient:
+    print("Connecting to IMAP…")
+    server = IMAPClient(IMAP_HOST, port=IMAP_PORT, use_uid=True, ssl=IMAP_SSL)
+    server.login(GMAIL_EMAIL, GMAIL_APP_PASSWORD)
+    server.select_folder(MAILBOX)
+    print("Using label:", MAILBOX)
+    ensure_folder(server, PROCESSED_FOLDER)
+    return server
+
+def mark_handled(server: IMAPClient, uids):
+    """Mark read + move to Processed for a whole batch of UIDs (MOVE if supported, else copy + delete)."""
+    finish_messages(server, uids, PROCESSED_FOLDER)
+
+# Staged ingest: fetch (main thread, owns IMAP) → OCR → GPT → persist, connected by bounded queues
+OCR_STAGE_WORKERS = int(os.getenv("OCR_STAGE_WORKERS", "2"))  # each fans pages out to the OCR process pool
+
+class InvoiceJob:
+    """One email with PDF attachments travelling through the pipeline."""
+    def __init__(self, checkpoint, uid, msg, pdfs, stage="downloaded", fields=None, known=()):
+        self.checkpoint = checkpoint
+        self.uid = uid
+        self.msg = msg
+        self.pdfs = pdfs      # [{"path", "file", "sha"}] from save_pdf_attachments
+        self.stage = stage    # last stage recorded in the checkpoint (where a resumed job picks up)
+        self.known = set(known)  # shas already in the dedup index: no OCR/GPT, fields stay None
+        self.texts = None
+        self.fields = fields
+        self.saved = []       # UIDs whose Excel rows were saved while this job queued its own
+
+    def todo(self):
+        return [a for a in self.pdfs if a["sha"] not in self.known]
+
+def ocr_stage(job: InvoiceJob) -> InvoiceJob:
+    if job.fields is not None:  # resumed after GPT: nothing to OCR
+        return job
+    todo = job.todo()
+    paths = [a["path"] for a in todo]
+    texts = extract_texts(paths, shas={a["path"]: a["sha"] for a in todo}) if todo else {}  # all pages share the OCR pool
+    job.texts = [texts[p] for p in paths]
+    return job
+
+async def extract_stage(job: InvoiceJob) -> InvoiceJob:
+    if job.fields is not None:
+        return job
+    # GPT calls for all PDFs of the email run concurrently, under the shared rate limiter
+    extracted = iter(await asyncio.gather(*(extract_fields_async(t) for t in job.texts)))
+    job.fields = [None if a["sha"] in job.known else next(extracted) for a in job.pdfs]
+    job.checkpoint.record(job.uid, "extracted", fields=job.fields)
+    return job
+
+def persist_stage(job: InvoiceJob) -> InvoiceJob:
+    # 1) Save to Postgres: every invoice of this email + its email row in ONE transaction
+    mid = job.msg.get("Message-ID") or job.msg.get("Message-Id") or ""
+    new_rows = job.fields  # resumed after "persisted": holds only the fields that produced new rows
+    if RANK[job.stage] < RANK["persisted"]:
+        new_rows = [None] * len(job.pdfs)
+        emitted = set()  # digests whose rows are already queued for this email (same PDF attached twice)
+        with unit_of_work() as cur:
+            # checked again here (single writer): the same PDF may have arrived twice in this pass
+            known = dedup_index.lookup(cur, [a["sha"] for a in job.pdfs])
+            for i, (att, fields) in enumerate(zip(job.pdfs, job.fields)):
+                file_name = att["file"]
+                hit = known.get(att["sha"])
+                if hit:
+                    invoice_id, first_mid = hit
+                    print(f"[DEDUP] {file_name} is already invoice {invoice_id}, linking this email only")
+                    insert_email_invoice(cur, invoice_id, file_name, job.msg)
+                    if mid and first_mid == mid and fields is not None and att["sha"] not in emitted:
+                        new_rows[i] = fields  # our own insert from a run that died before the checkpoint
+                        emitted.add(att["sha"])
                     continue
+                print(f"Processing {file_name}")
+                print("[FIELDS]", json.dumps(fields, ensure_ascii=False))
+                print("[KEYS] inv:", (fields.get("Invoice Number") or "").strip(),
+                      "total:", fields.get("Total Amount"), "tax:", fields.get("Tax Amount"))
+                invoice_id = insert_invoice_email_pipeline(cur, file_name, fields)
+                insert_email_invoice(cur, invoice_id, file_name, job.msg)
+                dedup_index.record(cur, att["sha"], invoice_id, file_name, mid)
+                known[att["sha"]] = (invoice_id, mid)
+                new_rows[i] = fields
+                emitted.add(att["sha"])
+        job.checkpoint.record(job.uid, "persisted", fields=new_rows)  # a resume re-queues exactly these
+    else:
+        print(f"[CHECKPOINT] UID {job.uid} already in Postgres, only re-queuing its Excel rows")
+
+    # 2) Save to Excel as well (after the DB commit; saved in batches by the sink); duplicates get no AP rows
+    xlsx_path = os.getenv("SHAREPOINT_XLSX")
+    rows = [f for f in new_rows if f is not None]
+    if rows:
+        job.saved = append_ap_rows_to_excel(xlsx_path, rows, job.uid)
+        for fields in rows:
+            print("[EXCEL] queued for", (fields.get("Invoice Number") or "").strip(), "→", xlsx_path)
+    else:
+        job.saved = [job.uid]  # nothing to add to Excel
+    # "written" exactly when the save that holds their rows is on disk (this may cover earlier jobs)
+    job.checkpoint.record_many(job.saved, "written")
+    return job
+
+def build_pipeline() -> Pipeline:
+    return Pipeline([
+        Stage("ocr",     ocr_stage,     workers=OCR_STAGE_WORKERS),
+        Stage("extract", extract_stage, workers=LLM_CONCURRENCY, kind="async", loop=background_loop()),
+        Stage("persist", persist_stage, workers=1),  # single writer: Postgres + Excel sink
+    ])
+
+def drain_pipeline(pipe: Pipeline, cp: MailboxCheckpoint) -> list:
+    """
+    Wait for every job of a closed pipeline, then save the Excel rows still pending.
+    Returns the sorted UIDs whose invoices are in Postgres and whose Excel rows are saved.
+    """
+    written = set()
+    for job in pipe.results():
+        if isinstance(job, Failed):
+            print(f"❌ Error handling message {job.item.uid} ({job.stage}):", job.error)
+            cp.failed(job.item.uid, job.error)
+        else:
+            written.update(job.saved)
+    print("[PIPELINE]", pipe.summary())
 
-                for pdf_path in pdfs:
-                    file_name = os.path.basename(pdf_path)
-                    print(f"Processing {file_name}")
-                    text   = extract_text_from_pdf(pdf_path)
-                    fields = extract_fields_with_gpt(text)
-                    import json
-                    print("[FIELDS]", json.dumps(fields, ensure_ascii=False))
-                    inv_no = (fields.get("Invoice Number") or "").strip()
-                    print("[KEYS] inv:", inv_no, "total:", fields.get("Total Amount"), "tax:", fields.get("Tax Amount"))
-
-
-                    # 1) Save to Postgres
-                    invoice_id = insert_invoice_email_pipeline(file_name, fields)
-                    insert_email_invoice(invoice_id, file_name, msg)
-
-                    # 2) Save to Excel as well
-                    xlsx_path = os.getenv("SHAREPOINT_XLSX")
-                    append_ap_rows_to_excel(xlsx_path, fields)
-                    print("[EXCEL] appended for", inv_no, "→", xlsx_path)
-
-
-
-                # Mark handled: read + move to Processed + delete original
-                server.add_flags(uid, [b"\\Seen"])
-                server.copy(uid, PROCESSED_FOLDER)
-                server.delete_messages(uid)
-
-                print("✅ Message processed and moved.")
-
+    try:
+        saved = flush_all()
+        cp.record_many(saved, "written")
+        written.update(saved)
+    except Exception as e:
+        print("❌ Excel save failed, their rows will be re-queued next pass:", e)
+        traceback.print_exc()
+        discard_all()  # unsaved messages are still "persisted": next pass only redoes the Excel append
+    return sorted(written)
+
+def process_mailbox(server: IMAPClient):
+    """
+    Process every message that arrived since the last pass, plus unfinished ones from earlier passes.
+    New mail is found by UID high-water mark (mail_checkpoint.py), not by the UNSEEN flag, and each
+    message resumes after the last stage it completed, so a crash only costs the unfinished stage.
+    This thread fetches messages and feeds the pipeline (blocking when OCR falls behind);
+    OCR, GPT and the writer work on other messages at the same time.
+    A message is recorded "written" by the Excel save that wrote its rows (mid-pass or at the end)
+    and only then moved to Processed, so its rows are never re-queued once they are on disk and
+    a crash never leaves a message marked done with its rows still unsaved.
+    Returns the UID high-water mark the pass searched up to.
+    """
+    info = server.select_folder(MAILBOX)
+    cp = MailboxCheckpoint(MAILBOX, info[b"UIDVALIDITY"])
+    cp.prune()
+    if cp.fresh:
+        # first run (or UIDVALIDITY changed): the unread mail is the backlog, anything newer comes next pass
+        uids = server.search("UNSEEN")
+        cp.discovered(uids, high_water=info.get(b"UIDNEXT", 1) - 1)
+        print("Unread count:", len(uids))
+    else:
+        last = cp.last_uid
+        uids = [u for u in server.search(["UID", f"{last + 1}:*"]) if u > last]  # n:* always matches the newest
+        cp.discovered(uids)
+        print(f"New since UID {last}:", len(uids))
+
+    to_fetch, resume, to_move = [], [], []
+    for row in cp.pending():
+        row["pdfs"] = [as_attachment(p) for p in row["pdfs"] or []]
+        if row["stage"] == "written":
+            to_move.append(row["uid"])
+        elif row["stage"] != "new" and row["pdfs"] and all(os.path.exists(a["path"]) for a in row["pdfs"]):
+            resume.append(row)
+        else:
+            to_fetch.append(row["uid"])
+    if not (to_fetch or resume or to_move):
+        print("No new messages.")
+        return cp.last_uid
+
+    pipe = build_pipeline().start()
+    try:
+        # Stopped part-way last time: no download, pick up after the last finished stage
+        if resume:  # attachments indexed since the crash skip OCR/GPT here too
+            with unit_of_work() as cur:
+                indexed = dedup_index.lookup(cur, [a["sha"] for row in resume for a in row["pdfs"]])
+        for row in resume:
+            print(f"[CHECKPOINT] resuming UID {row['uid']} after {row['stage']}")
+            msg = email.message_from_bytes(row["header"] or b"")
+            known = {a["sha"]: indexed[a["sha"]] for a in row["pdfs"] if a["sha"] in indexed}
+            pipe.submit(InvoiceJob(cp, row["uid"], msg, row["pdfs"], row["stage"], row["fields"], known=known))
+
+        # Per IMAP_FETCH_CHUNK uids: ENVELOPE/BODYSTRUCTURE first, PDF parts only for the rest
+        for chunk in chunked(to_fetch):
+            skipped = []  # no invoice to process: moved to Processed right away, in one go
+            try:
+                wanted = []
+                summaries = prefetch(server, chunk)
+                cp.record_many(set(chunk) - {s.uid for s in summaries}, "done")  # moved/deleted by someone else
+                with unit_of_work() as cur:
+                    seen = dedup_index.known_messages(cur, [s.message_id for s in summaries])
+                for s in summaries:
+                    if s.message_id in seen:
+                        print(f"[DEDUP] {s.message_id} was already processed, not downloading it again")
+                        skipped.append(s.uid)
+                    elif not sender_allowed(s.sender):
+                        print(f"Skipping sender: {s.sender}")
+                        skipped.append(s.uid)
+                    elif s.pdf_parts == []:  # none, forwarded messages included: never downloaded
+                        print(f"No PDF attachments in: {s.subject}")
+                        skipped.append(s.uid)
+                    else:  # PDF parts, or None (unreadable BODYSTRUCTURE → full fetch)
+                        wanted.append(s)
+
+                for uid, msg, attachments in fetch_pdfs(server, wanted):
+                    try:
+                        pdfs = save_pdf_attachments(attachments)
+                        if not pdfs:
+                            print(f"No PDF attachments in: {msg.get('Subject','')}")
+                            skipped.append(uid)
+                            continue
+
+                        cp.record(uid, "downloaded", pdfs=pdfs, header=header_bytes(msg))
+                        with unit_of_work() as cur:
+                            known = dedup_index.lookup(cur, [a["sha"] for a in pdfs])
+                        pipe.submit(InvoiceJob(cp, uid, msg, pdfs, known=known))
+
+                    except Exception as e:
+                        print("❌ Error handling message:", e)
+                        traceback.print_exc()
+                        cp.failed(uid, e)
+
+                mark_handled(server, skipped)
+                cp.record_many(skipped, "done")
             except Exception as e:
-                print("❌ Error handling message:", e)
+                print(f"❌ Error fetching {len(chunk)} message(s):", e)
                 traceback.print_exc()
+    finally:
+        # Always drained, also when the IMAP session died: no stage threads may outlive this pass,
+        # or a reconnected pass would resubmit the same checkpoint rows to a second writer.
+        pipe.close()
+        written = drain_pipeline(pipe, cp)
+
+    for batch in chunked(written + to_move):
+        mark_handled(server, batch)
+        cp.record_many(batch, "done")
+    print(f"✅ {len(written) + len(to_move)} message(s) processed and moved.")
+
+    server.expunge()
+    print("[DIM]", dims.summary())
+    print("[CHECKPOINT]", cp.summary())
+    print("Done.")
+    return cp.last_uid
 
-        server.expunge()
-        print("Done.")
+def main():
+    setup()
+    server = connect_imap()
+    with server:
+        process_mailbox(server)
+
+def arrived_during_pass(server: IMAPClient, last_uid, seen_uidnext):
+    """
+    UIDNEXT now (and whether mail landed after the pass searched). IDLE only reports mail that arrives
+    once it has started, so without this a message delivered mid-pass would wait for the next one.
+    A UIDNEXT already seen doesn't count again: UIDs of mail deleted before we saw it leave gaps.
+    """
+    uidnext = server.folder_status(MAILBOX, [b"UIDNEXT"]).get(b"UIDNEXT", 0)
+    return uidnext, uidnext - 1 > last_uid and uidnext != seen_uidnext
+
+def wait_for_mail(server: IMAPClient):
+    """Block in IMAP IDLE until the server reports new mail or the IDLE needs renewing."""
+    server.idle()
+    started = time.monotonic()
+    try:
+        while time.monotonic() - started < IDLE_RENEW:
+            responses = server.idle_check(timeout=IDLE_TIMEOUT)
+            if any(r[1] in (b"EXISTS", b"RECENT") for r in responses if len(r) > 1):
+                print("[IDLE] new mail:", responses)
+                return
+    finally:
+        server.idle_done()
+
+def serve_forever():
+    """
+    Resident mode: imports, the OpenAI client and the Postgres pool are set up once;
+    the IMAP session stays logged in and IDLE wakes us as soon as mail arrives.
+    """
+    setup()
+    backoff = 5
+    while True:
+        try:
+            server = connect_imap()
+            with server:
+                backoff = 5
+                uidnext = None
+                while True:
+                    last_uid = process_mailbox(server)
+                    uidnext, arrived = arrived_during_pass(server, last_uid, uidnext)
+                    if arrived:
+                        print(f"[IDLE] mail arrived during the pass (UIDNEXT {uidnext}, last UID {last_uid}), running again")
+                        continue
+                    print("[IDLE] waiting for new mail…")
+                    wait_for_mail(server)
+        except KeyboardInterrupt:
+            print("⏹️ Daemon stopped.")
+            return
+        except Exception as e:
+            print(f"❌ IMAP session failed ({e}); reconnecting in {backoff}s")
+            traceback.print_exc()
+            time.sleep(backoff)
+            backoff = min(backoff * 2, RECONNECT_MAX)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    ap = argparse.ArgumentParser(description="IMAP → OCR → GPT → Postgres/Excel invoice ingest")
+    ap.add_argument("--daemon", action="store_true",
+                    help="stay resident and use IMAP IDLE instead of a single pass")
+    args = ap.parse_args()
+    setup()
+    if args.daemon:
+        serve_forever()
+    else:
+        main()
\ No newline at end of file
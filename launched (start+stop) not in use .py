@@ -7,9 +7,10 @@
   <array>
     <string>/Users/adityasmacbookair/Documents/Invoice Automation Project/venv/bin/python</string>
     <string>/Users/adityasmacbookair/Documents/Invoice Automation Project/ingest_outlook_imap_to_postgres.py</string>
+    <string>--daemon</string>
   </array>
   <key>WorkingDirectory</key><string>/Users/adityasmacbookair/Documents/Invoice Automation Project</string>
-  <key>StartInterval</key><integer>120</integer> <!-- every 2 minutes -->
+  <key>KeepAlive</key><true/> <!-- resident IMAP IDLE daemon; launchd restarts it if it exits -->
   <key>StandardOutPath</key><string>/Users/adityasmacbookair/Documents/Invoice Automation Project/ingest.out.log</string>
   <key>StandardErrorPath</key><string>/Users/adityasmacbookair/Documents/Invoice Automation Project/ingest.err.log</string>
   <key>EnvironmentVariables</key>
@@ -0,0 +1,218 @@
+"""
+Bulk extraction through the OpenAI Batch API, for folder backfills that don't need answers now.
+
+Flow: OCR every unprocessed PDF → write one /v1/chat/completions request per PDF (same prompt
+and model as extract_fields_with_gpt, custom_id = file name) into a batch input JSONL → upload +
+create the batch → poll until it finishes → parse each answer and append it to the results
+JSONL as {"file": ..., "output": {...}}, the same format the synchronous batch scripts write.
+
+Batch jobs don't count against the per-minute rate limits and are billed at the batch discount.
+Texts already in llm_cache are written straight to the results file without being sent.
+Progress is kept in <out>.batch.json, so an interrupted run can pick up polling with --resume.
+Results go through batch_index's ResultWriter, so the checkpoint index (<out>.idx) stays in step
+with batch_runner's; each PDF's SHA-256 and size/mtime are taken at submit time and kept in the
+state file, so a PDF replaced while its batch was running is still seen as changed next run.
+Point OPENAI_BASE_URL at a local stub server to run the whole flow without the real API.
+
+Usage:
+  python llm_batch.py --dir invoices_output --out results_full_fields.jsonl
+  python llm_batch.py --dir bulk_invoices --out results_batch.jsonl --resume
+"""
+
+import os
+import json
+import time
+import argparse
+
+from ocr import extract_texts
+from ocr_cache import file_sha256
+import llm_cache
+from batch_index import BatchIndex, ResultWriter
+from llm_extract import (
+    get_client, build_messages, parse_response, EXTRACT_MODEL, PROMPT_VERSION, MAX_OUTPUT_TOKENS,
+)
+
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "50000"))  # API limit per batch
+BATCH_POLL_SECONDS = int(os.getenv("BATCH_POLL_SECONDS", "60"))
+BATCH_ENDPOINT     = "/v1/chat/completions"
+FINAL_STATES       = ("completed", "failed", "expired", "cancelled")
+
+
+def request_line(file_name: str, text: str) -> dict:
+    return {
+        "custom_id": file_name,
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": {
+            "model": EXTRACT_MODEL,
+            "temperature": 0,
+            "max_tokens": MAX_OUTPUT_TOKENS,
+            "messages": build_messages(text),
+        },
+    }
+
+
+def write_batch_inputs(items, prefix: str) -> list:
+    """Write (file_name, text) items into one or more batch input files; returns their paths."""
+    paths = []
+    for n, start in enumerate(range(0, len(items), BATCH_MAX_REQUESTS)):
+        path = f"{prefix}.input{n}.jsonl"
+        with open(path, "w") as f:
+            for file_name, text in items[start:start + BATCH_MAX_REQUESTS]:
+                f.write(json.dumps(request_line(file_name, text), ensure_ascii=False) + "\n")
+        paths.append(path)
+    return paths
+
+
+def submit(input_path: str) -> str:
+    client = get_client()
+    with open(input_path, "rb") as f:
+        uploaded = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(
+        input_file_id=uploaded.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window="24h",
+        metadata={"prompt_version": PROMPT_VERSION, "source": os.path.basename(input_path)},
+    )
+    print(f"📤 submitted {input_path} → batch {batch.id}")
+    return batch.id
+
+
+def poll(batch_id: str, interval: int = BATCH_POLL_SECONDS):
+    client = get_client()
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        if counts is not None:
+            print(f"⏳ batch {batch_id}: {batch.status} ({counts.completed}/{counts.total} done, {counts.failed} failed)")
+        else:
+            print(f"⏳ batch {batch_id}: {batch.status}")
+        if batch.status in FINAL_STATES:
+            return batch
+        time.sleep(interval)
+
+
+def _fingerprint(path) -> list:
+    st = os.stat(path)
+    return [file_sha256(path), st.st_size, st.st_mtime_ns]
+
+
+def _unchanged_path(invoice_dir, name, size, mtime_ns):
+    """The PDF's path if it is still the file that was submitted, else None (the index then falls back to the hash)."""
+    path = os.path.join(invoice_dir, name)
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return path if (st.st_size, st.st_mtime_ns) == (size, mtime_ns) else None
+
+
+def collect(batch, keys: dict, out_path: str, invoice_dir: str) -> int:
+    """
+    Parse a finished batch's output, cache each answer and append it to out_path. Returns rows written.
+    keys: {file name: [llm cache key, sha256, size, mtime_ns]} as recorded at submit time.
+    """
+    client = get_client()
+    written = 0
+    if batch.error_file_id:
+        errors = client.files.content(batch.error_file_id).text
+        for line in errors.splitlines():
+            if line.strip():
+                err = json.loads(line)
+                print(f"❌ {err.get('custom_id')}: {err.get('error') or err.get('response', {}).get('body')}")
+    if not batch.output_file_id:
+        return 0
+
+    index = BatchIndex(out_path)
+    output = client.files.content(batch.output_file_id).text
+    writer = ResultWriter(out_path, index)
+    try:
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            file_name = row.get("custom_id")
+            response = row.get("response") or {}
+            if row.get("error") or response.get("status_code") != 200:
+                print(f"❌ {file_name}: {row.get('error') or response.get('body')}")
+                continue
+            if file_name in index:
+                continue
+            data = parse_response(response["body"]["choices"][0]["message"]["content"])
+            sha = path = None
+            if file_name in keys:
+                entry = keys[file_name]
+                if isinstance(entry, str):  # state file from before hashes were kept: key only
+                    entry = [entry, None, None, None]
+                key, sha, size, mtime_ns = entry
+                llm_cache.put(key, data, PROMPT_VERSION, EXTRACT_MODEL)
+                if sha:
+                    path = _unchanged_path(invoice_dir, file_name, size, mtime_ns)
+            writer.write(file_name, data, sha=sha, path=path)
+            written += 1
+    finally:
+        writer.close()
+    return written
+
+
+def run_batch_job(invoice_dir: str, out_path: str, resume: bool = False, poll_interval: int = BATCH_POLL_SECONDS):
+    """OCR → batch submit → poll → merge, for every PDF in invoice_dir not yet in out_path."""
+    state_path = out_path + ".batch.json"
+    state = None
+    if resume and os.path.exists(state_path):
+        with open(state_path) as f:
+            state = json.load(f)
+        print(f"↩️ resuming {len(state['batches'])} batch(es) from {state_path}")
+
+    if state is None:
+        index = BatchIndex(out_path)
+        names = index.todo(invoice_dir, sorted(f for f in os.listdir(invoice_dir) if f.endswith(".pdf")))
+        if not names:
+            print("Nothing to do.")
+            return
+        paths = {n: os.path.join(invoice_dir, n) for n in names}
+        prints = {n: _fingerprint(p) for n, p in paths.items()}  # before OCR: the content the answer is for
+        texts = extract_texts(list(paths.values()), shas={p: prints[n][0] for n, p in paths.items()})
+
+        keys, pending = {}, []
+        writer = ResultWriter(out_path, index)
+        try:
+            for name in names:
+                text = texts[paths[name]]
+                key = llm_cache.cache_key(text, PROMPT_VERSION, EXTRACT_MODEL)
+                keys[name] = [key] + prints[name]
+                cached = llm_cache.get(key)
+                if cached is not None:
+                    writer.write(name, cached, sha=prints[name][0],
+                                 path=_unchanged_path(invoice_dir, name, *prints[name][1:]))
+                else:
+                    pending.append((name, text))
+        finally:
+            writer.close()
+        print(f"🗂️ {len(names) - len(pending)} answered from cache, {len(pending)} to submit")
+        if not pending:
+            return
+
+        inputs = write_batch_inputs(pending, out_path)
+        state = {"dir": invoice_dir, "keys": keys, "batches": [submit(p) for p in inputs]}
+        with open(state_path, "w") as f:
+            json.dump(state, f)
+
+    total = 0
+    for batch_id in state["batches"]:
+        batch = poll(batch_id, poll_interval)
+        if batch.status != "completed":
+            print(f"⚠️ batch {batch_id} ended as {batch.status}; collecting whatever finished")
+        total += collect(batch, state["keys"], out_path, state.get("dir", invoice_dir))
+    os.remove(state_path)
+    print(f"✅ merged {total} results into {out_path}")
+
+
+if __name__ == "__main__":  # OCR workers re-import this module
+    ap = argparse.ArgumentParser(description="Extract invoice fields for a folder via the OpenAI Batch API")
+    ap.add_argument("--dir", default="invoices_output", help="folder of PDFs")
+    ap.add_argument("--out", default="results_full_fields.jsonl", help="results JSONL (appended, keyed by file)")
+    ap.add_argument("--resume", action="store_true", help="keep polling batches recorded in <out>.batch.json")
+    ap.add_argument("--poll-interval", type=int, default=BATCH_POLL_SECONDS)
+    args = ap.parse_args()
+    run_batch_job(args.dir, args.out, resume=args.resume, poll_interval=args.poll_interval)
@@ -0,0 +1,142 @@
+"""
+Persistent cache of LLM extraction results, so the same invoice text never goes to OpenAI twice.
+
+Key = SHA-256 of (normalized text, prompt version, model). Whitespace is collapsed before
+hashing, so OCR runs that differ only in spacing or trailing form feeds still hit.
+Entries live in a small SQLite file and expire after LLM_CACHE_TTL_DAYS. Past
+LLM_CACHE_MAX_ENTRIES the least recently used rows are dropped.
+
+Env:
+  LLM_CACHE_PATH=.llm_cache.sqlite
+  LLM_CACHE_TTL_DAYS=90         # 0 = never expire
+  LLM_CACHE_MAX_ENTRIES=50000   # 0 disables the cache
+
+CLI:
+  python llm_cache.py --stats
+  python llm_cache.py --invalidate v1   # drop every entry made with prompt version v1
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+
+LLM_CACHE_PATH        = os.getenv("LLM_CACHE_PATH", ".llm_cache.sqlite")
+LLM_CACHE_TTL_DAYS    = float(os.getenv("LLM_CACHE_TTL_DAYS", "90"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "50000"))
+
+stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+_db = None
+_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    return LLM_CACHE_MAX_ENTRIES > 0
+
+
+def _conn():
+    global _db
+    if _db is None:
+        _db = sqlite3.connect(LLM_CACHE_PATH, check_same_thread=False)
+        _db.execute("PRAGMA journal_mode=WAL")
+        _db.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key            TEXT PRIMARY KEY,
+                prompt_version TEXT NOT NULL,
+                model          TEXT NOT NULL,
+                response       TEXT NOT NULL,
+                created_at     REAL NOT NULL,
+                last_used      REAL NOT NULL
+            )""")
+        _db.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_used ON llm_cache(last_used)")
+        _db.execute("CREATE INDEX IF NOT EXISTS llm_cache_prompt ON llm_cache(prompt_version)")
+        _db.commit()
+    return _db
+
+
+def cache_key(text: str, prompt_version: str, model: str) -> str:
+    normalized = " ".join((text or "").split())
+    payload = json.dumps([normalized, prompt_version, model])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get(key: str):
+    """Cached extraction dict for key, or None (missing or past its TTL)."""
+    if not enabled():
+        return None
+    now = time.time()
+    with _lock:
+        db = _conn()
+        row = db.execute("SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row and LLM_CACHE_TTL_DAYS > 0 and now - row[1] > LLM_CACHE_TTL_DAYS * 86400:
+            db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            db.commit()
+            stats["evictions"] += 1
+            row = None
+        if not row:
+            stats["misses"] += 1
+            return None
+        db.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key))
+        db.commit()
+        stats["hits"] += 1
+    return json.loads(row[0])
+
+
+def put(key: str, data: dict, prompt_version: str, model: str):
+    if not enabled():
+        return
+    now = time.time()
+    with _lock:
+        db = _conn()
+        db.execute(
+            "INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?, ?)",
+            (key, prompt_version, model, json.dumps(data, ensure_ascii=False), now, now),
+        )
+        count = db.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        if count > LLM_CACHE_MAX_ENTRIES:
+            cur = db.execute(
+                "DELETE FROM llm_cache WHERE key IN "
+                "(SELECT key FROM llm_cache ORDER BY last_used LIMIT ?)",
+                (count - LLM_CACHE_MAX_ENTRIES,),
+            )
+            stats["evictions"] += cur.rowcount
+        db.commit()
+
+
+def invalidate(prompt_version: str) -> int:
+    """Delete every entry created with prompt_version; returns the number of rows removed."""
+    with _lock:
+        db = _conn()
+        cur = db.execute("DELETE FROM llm_cache WHERE prompt_version = ?", (prompt_version,))
+        db.commit()
+    return cur.rowcount
+
+
+def summary() -> str:
+    with _lock:
+        hits, misses, evictions = stats["hits"], stats["misses"], stats["evictions"]
+    total = hits + misses
+    rate = (hits / total * 100) if total else 0.0
+    return f"hits={hits} misses={misses} evictions={evictions} hit_rate={rate:.0f}%"
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Inspect or invalidate the LLM extraction cache")
+    ap.add_argument("--invalidate", metavar="PROMPT_VERSION", help="drop all entries for this prompt version")
+    ap.add_argument("--stats", action="store_true", help="show entry counts per prompt version/model")
+    args = ap.parse_args()
+
+    if args.invalidate:
+        print(f"🗑️ removed {invalidate(args.invalidate)} entries for prompt version {args.invalidate}")
+    if args.stats or not args.invalidate:
+        rows = _conn().execute(
+            "SELECT prompt_version, model, COUNT(*) FROM llm_cache GROUP BY 1, 2 ORDER BY 1, 2"
+        ).fetchall()
+        for pv, model, n in rows:
+            print(f"{pv}\t{model}\t{n}")
+        if not rows:
+            print("(cache is empty)")
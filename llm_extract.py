@@ -0,0 +1,419 @@
+"""
+GPT field extraction shared by the ingest script and the batch scripts.
+
+One OpenAI client per process: its httpx pool keeps TLS connections to the API alive between
+invoices instead of building a new client (and handshake) for every call. The transport counts
+new TCP connections so we can see how many requests rode on a reused one.
+
+extract_fields_async() runs the extraction as a coroutine; callers (the ingest pipeline, batch_runner)
+keep LLM_CONCURRENCY of them in flight on the shared background asyncio loop. A token bucket keeps
+us under the account's requests/min and tokens/min limits; 429/5xx/network errors are retried with jittered exponential backoff, and a
+Retry-After from the API pauses every worker, not just the one that got throttled.
+
+Env:
+  OPENAI_API_KEY=sk-...
+  OPENAI_BASE_URL=               # optional, e.g. a local stub server
+  OPENAI_MAX_CONNECTIONS=20
+  OPENAI_MAX_KEEPALIVE=10
+  OPENAI_KEEPALIVE_EXPIRY=120    # seconds an idle connection is kept
+  OPENAI_TIMEOUT=60
+  LLM_CONCURRENCY=8              # extraction requests in flight
+  OPENAI_RPM=500                 # requests/min budget
+  OPENAI_TPM=200000              # tokens/min budget
+  LLM_MAX_RETRIES=6
+  LLM_BACKOFF_BASE=1.0           # seconds; doubles per attempt, with jitter
+  LLM_BACKOFF_MAX=60
+"""
+
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import threading
+
+import httpx
+import openai
+from openai import OpenAI, AsyncOpenAI
+
+import llm_cache
+
+OPENAI_MAX_CONNECTIONS  = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+OPENAI_MAX_KEEPALIVE    = int(os.getenv("OPENAI_MAX_KEEPALIVE", "10"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "120"))
+OPENAI_TIMEOUT          = float(os.getenv("OPENAI_TIMEOUT", "60"))
+LLM_CONCURRENCY  = int(os.getenv("LLM_CONCURRENCY", "8"))
+OPENAI_RPM       = int(os.getenv("OPENAI_RPM", "500"))
+OPENAI_TPM       = int(os.getenv("OPENAI_TPM", "200000"))
+LLM_MAX_RETRIES  = int(os.getenv("LLM_MAX_RETRIES", "6"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1.0"))
+LLM_BACKOFF_MAX  = float(os.getenv("LLM_BACKOFF_MAX", "60"))
+MAX_OUTPUT_TOKENS = 600  # budgeted per request; the JSON answer is ~300 tokens
+
+# Bump PROMPT_VERSION whenever the prompt below changes so cached extractions are not reused
+# (old entries can be dropped with: python llm_cache.py --invalidate <old version>).
+PROMPT_VERSION = "v1"
+EXTRACT_MODEL  = "gpt-4o-mini"  # or "gpt-4.1-mini" if you have access
+
+REQUIRED_KEYS = ["Invoice Number","Invoice Date","Due Date","Vendor Name","Vendor Address",
+                 "PO Number","Billing Period","Account Number","Account Name","Account Manager",
+                 "Tax Code","Subtotal","Tax Amount","Currency","Total Amount","Line Description"]
+
+# --------------------------- Client ---------------------------
+
+conn_stats = {"requests": 0, "new_connections": 0}
+_stats_lock = threading.Lock()
+_client = None
+_client_lock = threading.Lock()
+
+
+class _CountingTransport(httpx.HTTPTransport):
+    """HTTP transport that counts requests and freshly opened TCP connections."""
+
+    def handle_request(self, request):
+        request.extensions["trace"] = self._trace
+        with _stats_lock:
+            conn_stats["requests"] += 1
+        return super().handle_request(request)
+
+    @staticmethod
+    def _trace(event_name, info):
+        if event_name == "connection.connect_tcp.complete":
+            with _stats_lock:
+                conn_stats["new_connections"] += 1
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+        keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+    )
+
+
+def get_client() -> OpenAI:
+    """The process-wide OpenAI client (created on first use)."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            http_client = httpx.Client(
+                transport=_CountingTransport(limits=_limits()),
+                timeout=OPENAI_TIMEOUT,
+            )
+            _client = OpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                base_url=os.getenv("OPENAI_BASE_URL") or None,
+                http_client=http_client,
+            )
+    return _client
+
+
+class _AsyncCountingTransport(httpx.AsyncHTTPTransport):
+    """Async twin of _CountingTransport (httpcore requires an async trace callback here)."""
+
+    async def handle_async_request(self, request):
+        request.extensions["trace"] = self._trace
+        with _stats_lock:
+            conn_stats["requests"] += 1
+        return await super().handle_async_request(request)
+
+    @staticmethod
+    async def _trace(event_name, info):
+        if event_name == "connection.connect_tcp.complete":
+            with _stats_lock:
+                conn_stats["new_connections"] += 1
+
+
+def connection_summary() -> str:
+    req, new = conn_stats["requests"], conn_stats["new_connections"]
+    return f"requests={req} new_connections={new} reused={max(req - new, 0)}"
+
+# --------------------------- Prompt ---------------------------
+
+def build_messages(text: str) -> list:
+    """Chat messages for the rich extraction prompt."""
+    system = (
+        "You are an information extraction service for invoices. "
+        "Return STRICT JSON only (no prose). Use null for unknowns."
+    )
+
+    user = f"""
+Extract the following fields from the invoice text.
+Return a SINGLE JSON object with EXACT keys and the following constraints:
+
+Keys (exact spelling):
+- "Invoice Number": string
+- "Invoice Date": string (YYYY-MM-DD if possible)
+- "Due Date": string (YYYY-MM-DD or null)
+- "Vendor Name": string or null
+- "Vendor Address": string or null
+- "PO Number": string or null
+- "Billing Period": string or null
+- "Account Number": string or null
+- "Account Name": string or null
+- "Account Manager": string or null
+- "Tax Code": string or null
+- "Subtotal": string or null                # numeric string, e.g., "680.00"
+- "Tax Amount": string or null              # numeric string, e.g., "34.00"
+- "Currency": string or null                # ISO code if obvious (USD, CAD, GBP, EUR, INR)
+- "Total Amount": string                    # numeric string, required
+- "Line Description": string or null        # short human label for this invoice (vendor + invno)
+
+Normalization rules:
+- Dates: prefer ISO YYYY-MM-DD if you can infer; else keep as seen.
+- Amounts: output ONLY digits and a decimal point (strip currency symbols and commas).
+- Currency: output a code like USD/CAD/INR/GBP/EUR if present or clearly implied; else null.
+- If a field truly does not appear, set it to null.
+
+Example output:
+{{
+  "Invoice Number": "INV-101905",
+  "Invoice Date": "2025-08-05",
+  "Due Date": "2025-08-24",
+  "Vendor Name": "Scott Inc",
+  "Vendor Address": "123 Example St, Toronto, ON",
+  "PO Number": "PO-77831",
+  "Billing Period": "2025-07",
+  "Account Number": "5850133469",
+  "Account Name": "Innovate Wireless Partnerships",
+  "Account Manager": "Cody Burke",
+  "Tax Code": "VAT-20%",
+  "Subtotal": "680.00",
+  "Tax Amount": "34.00",
+  "Currency": "CAD",
+  "Total Amount": "714.00",
+  "Line Description": "Scott Inc — INV-101905"
+}}
+
+INVOICE TEXT:
+\"\"\"{text}\"\"\"
+"""
+
+    return [
+        {"role": "system", "content": system},
+        {"role": "user",   "content": user},
+    ]
+
+
+def parse_response(raw: str) -> dict:
+    """Turn the model's reply into the normalized field dict."""
+    # Be tolerant to ```json fences
+    raw = (raw or "").strip()
+    if raw.startswith("```"):
+        raw = re.sub(r"^```(?:json)?\s*|\s*```$", "", raw, flags=re.IGNORECASE | re.DOTALL)
+
+    try:
+        data = json.loads(raw)
+    except Exception:
+        # last-ditch: try to locate the first {...}
+        m = re.search(r"\{.*\}", raw, flags=re.DOTALL)
+        data = json.loads(m.group(0)) if m else {}
+
+    # post-normalize numeric strings (strip $ and commas just in case)
+    def clean_amt(v):
+        if v is None: return None
+        s = str(v).replace("$","").replace(",","").strip()
+        # allow bare numbers only
+        return s
+
+    for k in ["Subtotal", "Tax Amount", "Total Amount"]:
+        if k in data:
+            data[k] = clean_amt(data[k])
+
+    # ensure required keys exist even if null
+    for k in REQUIRED_KEYS:
+        data.setdefault(k, None)
+
+    # sensible fallback for Line Description
+    if not data.get("Line Description"):
+        vn = (data.get("Vendor Name") or "Vendor").strip()
+        ino = (data.get("Invoice Number") or "").strip()
+        data["Line Description"] = f"{vn} — {ino}".strip(" —")
+
+    return data
+
+
+class Prompt:
+    """An extraction prompt: message builder, reply parser, model, and the version used in cache keys."""
+    def __init__(self, version, model, build, parse, max_tokens=MAX_OUTPUT_TOKENS):
+        self.version = version
+        self.model = model
+        self.build = build
+        self.parse = parse
+        self.max_tokens = max_tokens
+
+
+FULL_PROMPT = Prompt(PROMPT_VERSION, EXTRACT_MODEL, build_messages, parse_response)
+
+
+# --------------------------- Extraction ---------------------------
+
+def extract_fields_with_gpt(text: str) -> dict:
+    """
+    Use GPT to extract a rich set of invoice fields.
+    Returns strict JSON with predictable keys and normalized formats.
+    Identical text (same prompt version + model) is answered from llm_cache without an API call.
+    """
+    key = llm_cache.cache_key(text, PROMPT_VERSION, EXTRACT_MODEL)
+    cached = llm_cache.get(key)
+    if cached is not None:
+        print("[GPT] cache hit —", llm_cache.summary())
+        return cached
+
+    resp = get_client().chat.completions.create(
+        model=EXTRACT_MODEL,
+        temperature=0,
+        messages=build_messages(text),
+    )
+    data = parse_response(resp.choices[0].message.content)
+    print("[GPT] connections:", connection_summary())
+
+    llm_cache.put(key, data, PROMPT_VERSION, EXTRACT_MODEL)
+    return data
+
+
+# --------------------------- Concurrent extraction ---------------------------
+
+class TokenBucket:
+    """Refills `per_minute` units evenly over a minute; acquire() waits until enough are available."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, n: float) -> float:
+        self._refill()
+        n = min(n, self.capacity)
+        return 0.0 if self.tokens >= n else (n - self.tokens) / self.rate
+
+    def take(self, n: float):
+        self.tokens -= min(n, self.capacity)
+
+
+class RateLimiter:
+    """Requests/min + tokens/min budget shared by all async workers, plus a global Retry-After pause."""
+
+    def __init__(self, rpm: int = OPENAI_RPM, tpm: int = OPENAI_TPM):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, n_tokens: int):
+        async with self._lock:
+            while True:
+                wait = max(self.paused_until - time.monotonic(),
+                           self.requests.wait_time(1), self.tokens.wait_time(n_tokens))
+                if wait <= 0:
+                    self.requests.take(1)
+                    self.tokens.take(n_tokens)
+                    return
+                await asyncio.sleep(wait)
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+def _estimate_tokens(messages) -> int:
+    return sum(len(m["content"]) for m in messages) // 4 + MAX_OUTPUT_TOKENS
+
+
+def _retry_after(err) -> float:
+    """Seconds from a Retry-After / retry-after-ms header, or None."""
+    response = getattr(err, "response", None)
+    if response is None:
+        return None
+    try:
+        if response.headers.get("retry-after-ms"):
+            return float(response.headers["retry-after-ms"]) / 1000.0
+        if response.headers.get("retry-after"):
+            return float(response.headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+def _backoff(attempt: int) -> float:
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))  # full jitter
+
+
+_loop = None
+_async_client = None
+_limiter = None
+
+
+def background_loop():
+    """One long-lived event loop thread, so the async client and its connections survive between calls."""
+    global _loop, _async_client
+    with _client_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-extract", daemon=True).start()
+            http_client = httpx.AsyncClient(
+                transport=_AsyncCountingTransport(limits=_limits()),
+                timeout=OPENAI_TIMEOUT,
+            )
+            _async_client = AsyncOpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                base_url=os.getenv("OPENAI_BASE_URL") or None,
+                http_client=http_client,
+                max_retries=0,  # retries/backoff are handled below
+            )
+    return _loop
+
+
+def shared_limiter() -> RateLimiter:
+    """One requests/tokens budget for every async extraction in this process."""
+    global _limiter
+    if _limiter is None:
+        _limiter = RateLimiter()
+    return _limiter
+
+
+async def extract_fields_async(text: str, limiter: RateLimiter = None, prompt: Prompt = FULL_PROMPT) -> dict:
+    """
+    Async version of extract_fields_with_gpt (same cache, same prompt) with rate limiting and retries.
+    Must run on background_loop(), where the async client lives. Pass `prompt` for another field set.
+    """
+    key = llm_cache.cache_key(text, prompt.version, prompt.model)
+    cached = llm_cache.get(key)
+    if cached is not None:
+        return cached
+
+    background_loop()  # makes sure the async client exists
+    limiter = limiter or shared_limiter()
+    messages = prompt.build(text)
+    n_tokens = _estimate_tokens(messages)
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        await limiter.acquire(n_tokens)
+        try:
+            resp = await _async_client.chat.completions.create(
+                model=prompt.model,
+                temperature=0,
+                max_tokens=prompt.max_tokens,
+                messages=messages,
+            )
+            break
+        except (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError) as e:
+            if attempt == LLM_MAX_RETRIES:
+                raise
+            delay = _retry_after(e)
+            if delay is not None:
+                limiter.pause(delay)  # everyone backs off, not just this request
+            else:
+                delay = _backoff(attempt)
+            print(f"[GPT] {type(e).__name__}, retry {attempt + 1}/{LLM_MAX_RETRIES} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    data = prompt.parse(resp.choices[0].message.content)
+    llm_cache.put(key, data, prompt.version, prompt.model)
+    return data
+
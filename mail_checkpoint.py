@@ -0,0 +1,214 @@
+"""
+Per-mailbox sync checkpoint, so the ingest no longer depends on the UNSEEN flag and a restart only
+redoes work that never finished.
+
+For every mailbox we keep UIDVALIDITY and the highest UID already picked up (last_uid); each pass
+asks the server for `UID last_uid+1:*` only. Every message we pick up gets a row with the stage it
+reached:
+
+  new → downloaded → extracted → persisted → written → done
+        (PDFs saved)  (GPT fields) (Postgres)  (Excel saved) (moved to Processed)
+
+downloaded stores the PDF paths + raw header, extracted stores the GPT fields, so a message that
+crashed after GPT resumes straight at the DB write, and one that reached Postgres but not the
+workbook only gets its Excel rows re-appended. A message failing CHECKPOINT_MAX_ATTEMPTS passes in
+a row is parked (reported, not retried) until its row is cleared.
+
+If UIDVALIDITY changes (mailbox recreated/renumbered) the mailbox's rows are dropped and the next
+pass bootstraps from UNSEEN, like a first run.
+
+Env:
+  MAIL_CHECKPOINT_PATH=.mail_checkpoint.sqlite
+  CHECKPOINT_MAX_ATTEMPTS=5
+  CHECKPOINT_KEEP_DAYS=30       # done rows older than this are pruned
+
+CLI:
+  python mail_checkpoint.py            # show state per mailbox
+  python mail_checkpoint.py --reset INBOX
+"""
+
+import os
+import json
+import time
+import sqlite3
+import argparse
+import threading
+
+MAIL_CHECKPOINT_PATH    = os.getenv("MAIL_CHECKPOINT_PATH", ".mail_checkpoint.sqlite")
+CHECKPOINT_MAX_ATTEMPTS = int(os.getenv("CHECKPOINT_MAX_ATTEMPTS", "5"))
+CHECKPOINT_KEEP_DAYS    = float(os.getenv("CHECKPOINT_KEEP_DAYS", "30"))
+
+STAGES = ("new", "downloaded", "extracted", "persisted", "written", "done")
+RANK = {s: i for i, s in enumerate(STAGES)}
+
+_db = None
+_lock = threading.Lock()
+
+
+def _conn():
+    global _db
+    if _db is None:
+        _db = sqlite3.connect(MAIL_CHECKPOINT_PATH, check_same_thread=False)
+        _db.execute("PRAGMA journal_mode=WAL")
+        _db.execute("""
+            CREATE TABLE IF NOT EXISTS mailboxes (
+                mailbox     TEXT PRIMARY KEY,
+                uidvalidity INTEGER NOT NULL,
+                last_uid    INTEGER NOT NULL
+            )""")
+        _db.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                mailbox    TEXT NOT NULL,
+                uid        INTEGER NOT NULL,
+                stage      TEXT NOT NULL,
+                pdfs       TEXT,
+                header     BLOB,
+                fields     TEXT,
+                attempts   INTEGER NOT NULL DEFAULT 0,
+                error      TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (mailbox, uid)
+            )""")
+        _db.execute("CREATE INDEX IF NOT EXISTS messages_stage ON messages(mailbox, stage)")
+        _db.commit()
+    return _db
+
+
+class MailboxCheckpoint:
+    """Checkpoint of one selected mailbox; construct it with the UIDVALIDITY from SELECT."""
+
+    def __init__(self, mailbox: str, uidvalidity: int):
+        self.mailbox = mailbox
+        self.uidvalidity = int(uidvalidity)
+        with _lock:
+            db = _conn()
+            row = db.execute("SELECT uidvalidity, last_uid FROM mailboxes WHERE mailbox = ?",
+                             (mailbox,)).fetchone()
+            if row and row[0] != self.uidvalidity:
+                print(f"[CHECKPOINT] UIDVALIDITY of {mailbox} changed ({row[0]} → {self.uidvalidity}), starting over")
+                db.execute("DELETE FROM messages WHERE mailbox = ?", (mailbox,))
+                db.execute("DELETE FROM mailboxes WHERE mailbox = ?", (mailbox,))
+                db.commit()
+                row = None
+        self.fresh = row is None          # no usable checkpoint → bootstrap from UNSEEN
+        self.last_uid = row[1] if row else 0
+
+    # ---------- discovery ----------
+
+    def discovered(self, uids, high_water=0):
+        """Register newly found UIDs (stage new) and move last_uid past them / up to high_water."""
+        now = time.time()
+        last = max([self.last_uid, high_water, *uids])
+        with _lock:
+            db = _conn()
+            db.executemany(
+                "INSERT OR IGNORE INTO messages (mailbox, uid, stage, updated_at) VALUES (?, ?, 'new', ?)",
+                [(self.mailbox, u, now) for u in uids],
+            )
+            db.execute(
+                "INSERT INTO mailboxes VALUES (?, ?, ?) "
+                "ON CONFLICT (mailbox) DO UPDATE SET uidvalidity = excluded.uidvalidity, last_uid = excluded.last_uid",
+                (self.mailbox, self.uidvalidity, last),
+            )
+            db.commit()
+        self.fresh = False
+        self.last_uid = last
+
+    def pending(self):
+        """Unfinished messages from earlier passes: [{uid, stage, pdfs, header, fields, attempts}]."""
+        with _lock:
+            rows = _conn().execute(
+                "SELECT uid, stage, pdfs, header, fields, attempts FROM messages "
+                "WHERE mailbox = ? AND stage != 'done' ORDER BY uid",
+                (self.mailbox,),
+            ).fetchall()
+        out, parked = [], 0
+        for uid, stage, pdfs, header, fields, attempts in rows:
+            if attempts >= CHECKPOINT_MAX_ATTEMPTS:
+                parked += 1
+                continue
+            out.append({
+                "uid": uid, "stage": stage, "attempts": attempts,
+                "pdfs": json.loads(pdfs) if pdfs else None,
+                "header": header,
+                "fields": json.loads(fields) if fields else None,
+            })
+        if parked:
+            print(f"[CHECKPOINT] {parked} message(s) in {self.mailbox} parked after {CHECKPOINT_MAX_ATTEMPTS} failed attempts")
+        return out
+
+    # ---------- progress ----------
+
+    def record(self, uid, stage, pdfs=None, header=None, fields=None):
+        """Advance one message to stage (never backwards), storing whatever the stage produced."""
+        with _lock:
+            db = _conn()
+            row = db.execute("SELECT stage FROM messages WHERE mailbox = ? AND uid = ?",
+                             (self.mailbox, uid)).fetchone()
+            if row and RANK[row[0]] > RANK[stage]:
+                return
+            db.execute(
+                "INSERT INTO messages (mailbox, uid, stage, pdfs, header, fields, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (mailbox, uid) DO UPDATE SET stage = excluded.stage, "
+                "  pdfs = COALESCE(excluded.pdfs, pdfs), header = COALESCE(excluded.header, header), "
+                "  fields = COALESCE(excluded.fields, fields), error = NULL, updated_at = excluded.updated_at",
+                (self.mailbox, uid, stage,
+                 json.dumps(pdfs) if pdfs is not None else None,
+                 header,
+                 json.dumps(fields, ensure_ascii=False) if fields is not None else None,
+                 time.time()),
+            )
+            db.commit()
+
+    def record_many(self, uids, stage):
+        for uid in uids:
+            self.record(uid, stage)
+
+    def failed(self, uid, error):
+        with _lock:
+            db = _conn()
+            db.execute(
+                "UPDATE messages SET attempts = attempts + 1, error = ?, updated_at = ? "
+                "WHERE mailbox = ? AND uid = ?",
+                (str(error)[:500], time.time(), self.mailbox, uid),
+            )
+            db.commit()
+
+    def prune(self, keep_days=CHECKPOINT_KEEP_DAYS):
+        """Drop done rows older than keep_days (last_uid alone keeps them from being picked up again)."""
+        with _lock:
+            db = _conn()
+            cur = db.execute(
+                "DELETE FROM messages WHERE mailbox = ? AND stage = 'done' AND updated_at < ?",
+                (self.mailbox, time.time() - keep_days * 86400),
+            )
+            db.commit()
+        return cur.rowcount
+
+    def summary(self) -> str:
+        with _lock:
+            rows = _conn().execute(
+                "SELECT stage, COUNT(*) FROM messages WHERE mailbox = ? GROUP BY stage", (self.mailbox,)
+            ).fetchall()
+        counts = dict(rows)
+        return f"{self.mailbox} last_uid={self.last_uid} " + " ".join(
+            f"{s}={counts[s]}" for s in STAGES if counts.get(s))
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Inspect or reset the mailbox sync checkpoint")
+    ap.add_argument("--reset", metavar="MAILBOX", help="forget the checkpoint (next pass bootstraps from UNSEEN)")
+    args = ap.parse_args()
+
+    db = _conn()
+    if args.reset:
+        db.execute("DELETE FROM messages WHERE mailbox = ?", (args.reset,))
+        db.execute("DELETE FROM mailboxes WHERE mailbox = ?", (args.reset,))
+        db.commit()
+        print(f"🗑️ checkpoint for {args.reset} removed")
+    for mailbox, uidvalidity, last_uid in db.execute("SELECT * FROM mailboxes ORDER BY mailbox"):
+        counts = db.execute("SELECT stage, COUNT(*), SUM(attempts >= ?) FROM messages "
+                            "WHERE mailbox = ? GROUP BY stage", (CHECKPOINT_MAX_ATTEMPTS, mailbox)).fetchall()
+        print(f"{mailbox}\tuidvalidity={uidvalidity}\tlast_uid={last_uid}\t"
+              + " ".join(f"{s}={n}" + (f"(parked {p})" if p else "") for s, n, p in counts))
@@ -0,0 +1,70 @@
+"""
+One-off: merge duplicate vendors / accounts / purchase orders so their unique indexes can be built.
+
+Rows written before ensure_unique_keys() existed (SELECT-then-INSERT from several workers) can hold
+the same vendors.name / accounts.number / purchase_orders.po_number more than once, and then
+CREATE UNIQUE INDEX fails. For every such key this keeps the row with the lowest id, points the
+vendor_id / account_id / po_id of invoice_ai.invoices and invoice_ai.email_pipeline_invoices at it,
+deletes the other rows and creates the indexes, all in one transaction.
+
+Usage:
+  python migrate_dedupe_dimensions.py --dry-run   # only count what would be merged
+  python migrate_dedupe_dimensions.py
+
+Env: PG_DB, PG_USER, PG_PASSWORD, PG_HOST, PG_PORT (see pg_pool.py)
+"""
+
+import argparse
+
+from dim_cache import TABLES
+from pg_bulk import ensure_unique_keys, missing_unique
+from pg_pool import unit_of_work
+
+FACT_TABLES = ["invoices", "email_pipeline_invoices"]
+
+
+def merge_duplicates(cur, table, key, fk, dry_run=False) -> int:
+    """Fold duplicate `key` rows of invoice_ai.<table> into the lowest id. Returns rows removed."""
+    cur.execute("DROP TABLE IF EXISTS dim_merge")
+    cur.execute(f"""
+        CREATE TEMP TABLE dim_merge ON COMMIT DROP AS
+        SELECT id, keep FROM (
+            SELECT id, MIN(id) OVER (PARTITION BY {key}) AS keep
+            FROM invoice_ai.{table} WHERE {key} IS NOT NULL
+        ) ranked
+        WHERE id <> keep
+    """)
+    cur.execute("SELECT COUNT(*) FROM dim_merge")
+    n = cur.fetchone()[0]
+    if not n or dry_run:
+        return n
+    for fact in FACT_TABLES:
+        cur.execute("SELECT to_regclass(%s)", (f"invoice_ai.{fact}",))
+        if cur.fetchone()[0] is None:
+            continue
+        cur.execute(f"UPDATE invoice_ai.{fact} f SET {fk} = m.keep FROM dim_merge m WHERE f.{fk} = m.id")
+        print(f"  invoice_ai.{fact}: {cur.rowcount} {fk} repointed")
+    cur.execute(f"DELETE FROM invoice_ai.{table} d USING dim_merge m WHERE d.id = m.id")
+    return n
+
+
+def main(dry_run=False):
+    with unit_of_work() as cur:
+        for table, (key, fk) in TABLES.items():
+            n = merge_duplicates(cur, table, key, fk, dry_run)
+            print(f"{'[dry run] ' if dry_run else ''}invoice_ai.{table}: {n} duplicate row(s)"
+                  + ("" if dry_run else " merged"))
+        if dry_run:
+            cur.connection.rollback()
+            return
+        ensure_unique_keys(cur)
+        if missing_unique:  # duplicates appeared meanwhile: keep nothing half-done
+            raise SystemExit(f"❌ still no unique index on {sorted(missing_unique)}, rolled back; run again")
+    print("✅ unique indexes in place")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Merge duplicate dimension rows and create their unique indexes")
+    ap.add_argument("--dry-run", action="store_true", help="only report how many rows would be merged")
+    args = ap.parse_args()
+    main(dry_run=args.dry_run)
@@ -0,0 +1,96 @@
+"""
+Field normalization shared by the ingest, Excel and Postgres writers:
+dates (as_date → date, normalize_date → Excel-friendly MM/DD/YY), amounts and currency codes.
+
+Pass vendor= to the date functions to read DD/MM vs MM/DD the way that vendor writes dates
+(learned and remembered per vendor, see vendor_dates.py).
+"""
+
+import re
+from datetime import datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+from dateutil import parser as dateparser
+
+import vendor_dates
+
+def as_date(s, vendor=None):
+    if not s or not str(s).strip():
+        return None
+    if vendor:
+        dt = vendor_dates.parse(vendor, s)
+        if dt:
+            return dt.date()
+    try:
+        return dateparser.parse(str(s), dayfirst=vendor_dates.dayfirst(vendor)).date()
+    except Exception:
+        return None
+
+def as_decimal(s):
+    if s is None:
+        return None
+    if isinstance(s, (int, float)):
+        return float(s)
+    s = str(s).replace(",", "")
+    m = re.search(r"([-+]?\d+(\.\d+)?)", s)
+    return float(m.group(1)) if m else None
+
+_MONEY = re.compile(r"[-+]?\d+(?:\.\d+)?")
+CENT = Decimal("0.01")
+
+def as_money(s):
+    """Exact amount as Decimal rounded to cents ("$1,234.56", "(12.50)" → -12.50), or None."""
+    if s is None:
+        return None
+    if isinstance(s, Decimal):
+        return s.quantize(CENT, ROUND_HALF_UP)
+    if isinstance(s, (int, float)):
+        return Decimal(str(s)).quantize(CENT, ROUND_HALF_UP)
+    txt = str(s).replace(",", "").strip()
+    m = _MONEY.search(txt)
+    if not m:
+        return None
+    try:
+        value = Decimal(m.group(0)).quantize(CENT, ROUND_HALF_UP)
+    except InvalidOperation:
+        return None
+    if txt.startswith("(") and txt.endswith(")"):
+        value = -value
+    return value
+
+def derive_currency(amount_str, explicit_currency):
+    if explicit_currency and explicit_currency.strip():
+        return explicit_currency.strip().upper()
+    if not amount_str:
+        return None
+    txt = str(amount_str)
+    if "$" in txt: return "USD"
+    if "€" in txt: return "EUR"
+    if "£" in txt: return "GBP"
+    if "₹" in txt: return "INR"
+    if "C$" in txt: return "CAD"
+    if "A$" in txt: return "AUD"
+    # fallback if someone passes a code like usd/cad
+    c = txt.strip().upper()
+    return c if len(c) == 3 else None
+
+def normalize_date(s: str, vendor=None) -> str:
+    if not s: 
+        return ""
+    s = s.strip()
+    if vendor:
+        dt = vendor_dates.parse(vendor, s)
+        return dt.strftime("%m/%d/%y") if dt else s
+    fmts = [
+        "%Y-%m-%d", "%Y/%m/%d",                # 2025-09-10
+        "%m-%d-%Y", "%m/%d/%Y",                # 09-10-2025
+        "%d-%m-%Y", "%d/%m/%Y",                # 10-09-2025
+        "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S"
+    ]
+    for f in fmts:
+        try:
+            dt = datetime.strptime(s, f)
+            return dt.strftime("%m/%d/%y")     # Excel-friendly format
+        except Exception:
+            pass
+    return s  # if it’s some other readable format, keep as-is
@@ -0,0 +1,182 @@
+"""
+Column-at-a-time versions of normalize.py for backfills (pandas/numpy).
+
+normalize.as_date runs dateutil on every value, normalize_date tries up to 8 strptime formats per
+value, as_money/as_decimal run a regex per value and derive_currency a chain of substring checks.
+Re-normalizing a whole results file that way is mostly per-value Python overhead. Here each field is
+one pandas column:
+
+- dates: the format is detected once per vendor (or once per batch without vendors) from a small
+  sample of distinct values, then the whole group is parsed with pd.to_datetime(format=...). When
+  the sample can't tell DD/MM from MM/DD, the vendor's learned order decides (vendor_dates.py), and
+  unambiguous dates in the sample are counted towards it. Values the format doesn't match (a vendor
+  switching styles, free text) go through normalize.as_date.
+- amounts: sign / integer / fraction are pulled out with one regex extract and combined into exact
+  integer cents (rounded half up, "(12.50)" is negative, like normalize.as_money). Numbers too long
+  for that go through as_money; amounts of 10^16 or more come back as <NA>.
+- currency: explicit code, else symbol, else a bare 3-letter code (same rules as derive_currency).
+
+    df = normalize_outputs(outputs)        # outputs: list of extracted-field dicts
+    df.invoice_date, df.due_date           # datetime64[s], NaT when missing
+    df.total_amount                        # Int64 cents, <NA> when missing
+    df.currency                            # category
+
+Env:
+  NORMALIZE_SAMPLE=200   # distinct values per vendor used to pick a date format
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+try:  # Arrow-backed strings: .str methods and the regex run in C instead of once per value
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    STRING = "string[pyarrow]"
+except ImportError:
+    pa = pc = None
+    STRING = "string"
+
+import vendor_dates
+from normalize import as_date, as_money
+
+NORMALIZE_SAMPLE = int(os.getenv("NORMALIZE_SAMPLE", "200"))
+
+DATE_COLUMNS  = {"invoice_date": "Invoice Date", "due_date": "Due Date"}
+MONEY_COLUMNS = {"subtotal": "Subtotal", "tax_amount": "Tax Amount", "total_amount": "Total Amount"}
+
+SYMBOLS = [("$", "USD"), ("€", "EUR"), ("£", "GBP"), ("₹", "INR"), ("C$", "CAD"), ("A$", "AUD")]
+
+_AMOUNT = r"(?P<sign>[-+]?)(?P<int>\d+)(?:\.(?P<frac>\d+))?"
+_MAX_INT_DIGITS = 15  # whole units that still fit int64 cents
+
+stats = {"vectorized": 0, "fallback": 0}
+
+
+def _strings(values) -> pd.Series:
+    """Stripped strings, <NA> for missing/blank (numbers are stringified like str())."""
+    s = pd.Series(values, dtype=object).astype(STRING).str.strip()
+    return s.mask(s == "")
+
+
+def _extract(s: pd.Series, pattern) -> pd.DataFrame:
+    """s.str.extract(pattern); pandas still runs that per value, pyarrow's extract_regex doesn't."""
+    if pc is None:
+        return s.str.extract(pattern)
+    found = pc.extract_regex(pa.array(s.array), pattern)
+    fields = found.flatten()  # unlike .field(), carries "no match" into every group
+    return pd.DataFrame({f.name: pd.Series(pd.arrays.ArrowStringArray(arr), index=s.index)
+                         for f, arr in zip(found.type, fields)})
+
+
+def _flag(mask) -> pd.Series:
+    """Nullable boolean → plain bool (missing = False)."""
+    return mask.fillna(False).astype(bool)
+
+
+def _parses(sample, fmt) -> pd.Series:
+    return pd.to_datetime(sample, format=fmt, errors="coerce").notna()
+
+
+def detect_format(values: pd.Series, vendor=None):
+    """
+    The vendor_dates.FORMATS entry that parses most of a sample of distinct values (None if none
+    does). Ties go to the vendor's learned day/month order, then to the earlier format.
+    """
+    sample = values.dropna().drop_duplicates().head(NORMALIZE_SAMPLE)
+    formats = vendor_dates.FORMATS
+    learned = vendor_dates.preferred(vendor)
+    if learned:
+        formats = sorted(formats, key=lambda f: f in vendor_dates.ORDERED
+                         and vendor_dates.dayfirst_format(f) != vendor_dates.dayfirst_format(learned))
+    ok = {fmt: _parses(sample, fmt) for fmt in formats}
+    best = max(formats, key=lambda f: ok[f].sum())
+    if not ok[best].any():
+        return None
+    if best in vendor_dates.ORDERED:  # values only this order can read are votes for it
+        other = vendor_dates.swapped(best)
+        vendor_dates.learn(vendor, best, int((ok[best] & ~ok.get(other, _parses(sample, other))).sum()))
+    return best
+
+
+def _as_timestamp(v, vendor=None):
+    d = as_date(v, vendor=vendor)
+    if d is None:
+        return pd.NaT
+    try:
+        return pd.Timestamp(d)
+    except (ValueError, OverflowError):
+        return pd.NaT
+
+
+def parse_dates(values, groups=None) -> pd.Series:
+    """
+    datetime64[s] Series; one format per group (e.g. vendor), per-value fallback for the misses.
+    Seconds, not ns: to_datetime's ns range ends at 1677/2262, and OCR'd years can be anything.
+    """
+    s = _strings(values)
+    keys = pd.Series(groups if groups is not None else "", index=s.index, dtype=object).fillna("").map(vendor_dates.key)
+    out = pd.Series(pd.NaT, index=s.index, dtype="datetime64[s]")
+    for vendor, part in s.dropna().groupby(keys[s.notna()], sort=False):
+        fmt = detect_format(part, vendor)
+        parsed = pd.to_datetime(part, format=fmt, errors="coerce") if fmt else pd.Series(pd.NaT, index=part.index)
+        out[parsed.index] = parsed
+        misses = part[parsed.isna()]
+        stats["vectorized"] += len(part) - len(misses)
+        stats["fallback"] += len(misses)
+        if len(misses):
+            out[misses.index] = misses.map(lambda v: _as_timestamp(v, vendor)).astype("datetime64[s]")
+    return out
+
+
+def parse_money(values) -> pd.Series:
+    """Exact amounts as Int64 cents (half-up), <NA> where no number was found."""
+    s = _strings(values)
+    txt = s.str.replace(",", "", regex=False)
+    parts = _extract(txt, _AMOUNT)
+    ok = _flag(parts["int"].str.len() <= _MAX_INT_DIGITS)
+
+    whole = parts["int"].where(ok).astype("Int64")
+    frac3 = parts["frac"].where(ok).fillna("").str.slice(0, 3).str.pad(3, side="right", fillchar="0").astype("Int64")
+    cents = whole * 100 + (frac3 + 5) // 10  # third decimal decides, half up
+    negative = _flag(parts["sign"] == "-") ^ _flag(txt.str.startswith("(") & txt.str.endswith(")"))
+    cents = cents.where(~negative, -cents)
+
+    # too long for int64 cents: the exact per-value path
+    slow = parts["int"].notna() & ~ok
+    stats["vectorized"] += int(ok.sum())
+    stats["fallback"] += int(slow.sum())
+    for i in s.index[slow]:
+        m = as_money(s[i])
+        cents[i] = pd.NA if m is None or abs(m) >= 10 ** 16 else int(m * 100)
+    return cents
+
+
+def derive_currencies(amounts, explicit) -> pd.Series:
+    """derive_currency over two columns, as a categorical."""
+    code = _strings(explicit).str.upper()
+    amt = _strings(amounts)
+    conditions = [code.notna().to_numpy()]
+    conditions += [_flag(amt.str.contains(sym, regex=False)) for sym, _ in SYMBOLS]
+    conditions += [_flag(amt.str.len() == 3)]
+    choices = [code.astype(object)] + [c for _, c in SYMBOLS] + [amt.str.upper().astype(object)]
+    return pd.Series(np.select(conditions, choices, default=None), index=amt.index).astype("category")
+
+
+def normalize_outputs(outputs: list, vendor_key="Vendor Name") -> pd.DataFrame:
+    """Typed date/amount/currency columns for a list of extracted-field dicts."""
+    outputs = [o or {} for o in outputs]
+    vendors = [o.get(vendor_key) for o in outputs]
+    col = lambda key: [o.get(key) for o in outputs]
+    df = pd.DataFrame(index=range(len(outputs)))
+    for name, key in DATE_COLUMNS.items():
+        df[name] = parse_dates(col(key), vendors)
+    for name, key in MONEY_COLUMNS.items():
+        df[name] = parse_money(col(key))
+    df["currency"] = derive_currencies(col("Total Amount"), col("Currency"))
+    return df
+
+
+def summary() -> str:
+    return f"vectorized={stats['vectorized']} fallback={stats['fallback']}"
@@ -0,0 +1,209 @@
+"""
+Shared OCR for invoice PDFs: Poppler (pdf2image) rasterizes, Tesseract reads.
+
+Pages are independent jobs on a process pool, so a long utility bill is spread across
+all cores instead of holding up the queue, and several PDFs can share the pool at once.
+
+Digitally generated PDFs (vendor portals, fpdf test invoices) already carry a text layer; that
+text is read directly with pdfplumber and only pages without usable text go through Tesseract.
+
+Results are cached by PDF content hash + OCR settings (see ocr_cache.py), so the same file is
+only ever read once.
+
+Rasterization is streamed: each job renders a small window of pages to a temp dir at the
+configured DPI and hands the files straight to Tesseract, so no full-resolution PIL images are
+kept in memory and peak RSS stays flat however many pages a PDF has.
+
+Env:
+  OCR_WORKERS=8      # pool size (default: CPU count); 1 = run in-process, no pool
+  OCR_DPI=200        # rasterization DPI
+  OCR_GRAYSCALE=1    # render pages in grayscale (smaller, Tesseract binarizes anyway)
+  OCR_MAX_PAGES=0    # only OCR the first N pages (0 = all)
+  OCR_WINDOW=1       # pages rasterized per job
+  OCR_NATIVE_TEXT=1  # use the embedded text layer when a page has one
+  OCR_MIN_TEXT_CHARS=20  # fewer non-space chars than this → treat page as scanned and OCR it
+
+Scripts that use the pool must keep their work under `if __name__ == "__main__":`
+(spawned workers re-import the main module on macOS/Windows).
+"""
+
+import os
+import time
+import tempfile
+import threading
+from functools import lru_cache
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from pdf2image import convert_from_path, pdfinfo_from_path
+import pdfplumber
+import pytesseract
+
+import ocr_cache
+
+OCR_WORKERS   = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+OCR_DPI       = int(os.getenv("OCR_DPI", "200"))
+OCR_GRAYSCALE = os.getenv("OCR_GRAYSCALE", "1") == "1"
+OCR_MAX_PAGES = int(os.getenv("OCR_MAX_PAGES", "0"))
+OCR_WINDOW    = max(1, int(os.getenv("OCR_WINDOW", "1")))
+OCR_NATIVE_TEXT    = os.getenv("OCR_NATIVE_TEXT", "1") == "1"
+OCR_MIN_TEXT_CHARS = int(os.getenv("OCR_MIN_TEXT_CHARS", "20"))
+
+_pool = None
+_pool_lock = threading.Lock()  # OCR stage threads may ask for the pool at the same moment
+
+
+def get_pool():
+    """Lazily create the shared process pool (None when OCR_WORKERS <= 1)."""
+    global _pool
+    if _pool is None and OCR_WORKERS > 1:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=OCR_WORKERS)
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
+
+
+def page_count(pdf_path: str) -> int:
+    n = int(pdfinfo_from_path(pdf_path)["Pages"])
+    return min(n, OCR_MAX_PAGES) if OCR_MAX_PAGES > 0 else n
+
+
+def ocr_pages(pdf_path: str, first_page: int, last_page: int):
+    """
+    Rasterize + OCR a window of pages (runs inside a pool worker).
+    Pages go to a temp dir as PPM files and Tesseract reads them from disk, one at a time.
+    Returns [(page_no, text, seconds), ...].
+    """
+    out = []
+    with tempfile.TemporaryDirectory(prefix="ocr_") as tmp:
+        t0 = time.perf_counter()
+        paths = convert_from_path(
+            pdf_path, dpi=OCR_DPI, grayscale=OCR_GRAYSCALE,
+            first_page=first_page, last_page=last_page,
+            output_folder=tmp, fmt="ppm", paths_only=True,
+        )
+        raster_secs = (time.perf_counter() - t0) / max(len(paths), 1)
+        for page_no, path in enumerate(sorted(paths), start=first_page):
+            t1 = time.perf_counter()
+            text = pytesseract.image_to_string(path)
+            os.remove(path)
+            out.append((page_no, text, raster_secs + time.perf_counter() - t1))
+    return out
+
+
+def native_page_texts(pdf_path: str):
+    """
+    Text layer of each page via pdfplumber ("" for pages without usable text).
+    Returns None if the PDF can't be parsed, so the caller falls back to OCR for every page.
+    """
+    try:
+        with pdfplumber.open(pdf_path) as pdf:
+            pages = pdf.pages[:OCR_MAX_PAGES] if OCR_MAX_PAGES > 0 else pdf.pages
+            texts = []
+            for page in pages:
+                text = page.extract_text() or ""
+                page.close()  # drop pdfplumber's per-page object cache
+                usable = len("".join(text.split())) >= OCR_MIN_TEXT_CHARS
+                texts.append(text + "\n" if usable else "")
+            return texts
+    except Exception as e:
+        print(f"[OCR] no text layer for {os.path.basename(pdf_path)}: {e}")
+        return None
+
+
+def _windows(pdf_path, page_nos):
+    """Group consecutive page numbers into jobs of at most OCR_WINDOW pages."""
+    run = []
+    for n in page_nos:
+        if run and (n != run[-1] + 1 or len(run) == OCR_WINDOW):
+            yield pdf_path, run[0], run[-1]
+            run = []
+        run.append(n)
+    if run:
+        yield pdf_path, run[0], run[-1]
+
+
+def _run(jobs):
+    """Yield (job, pages) in submission order, keeping at most ~2 jobs per worker in flight."""
+    pool = get_pool()
+    if pool is None:
+        for job in jobs:
+            yield job, ocr_pages(*job)
+        return
+    in_flight = deque()
+    for job in jobs:
+        in_flight.append((job, pool.submit(ocr_pages, *job)))
+        if len(in_flight) >= OCR_WORKERS * 2:
+            done_job, fut = in_flight.popleft()
+            yield done_job, fut.result()
+    while in_flight:
+        done_job, fut = in_flight.popleft()
+        yield done_job, fut.result()
+
+
+@lru_cache(maxsize=1)
+def _tesseract_version() -> str:
+    return str(pytesseract.get_tesseract_version())
+
+
+def ocr_settings() -> dict:
+    """Everything that changes OCR output; part of the cache key."""
+    return {
+        "dpi": OCR_DPI, "grayscale": OCR_GRAYSCALE, "max_pages": OCR_MAX_PAGES,
+        "native": OCR_NATIVE_TEXT, "min_chars": OCR_MIN_TEXT_CHARS,
+        "tesseract": _tesseract_version(),
+    }
+
+
+def extract_texts(pdf_paths, shas=None) -> dict:
+    """
+    Text for several PDFs; scanned pages of all of them share the OCR pool.
+    Cached PDFs are returned without touching Poppler/Tesseract, pages with a text layer
+    are taken as-is. `shas` may map pdf_path → SHA-256 when the caller already hashed the file.
+    Returns {pdf_path: text}.
+    """
+    pdf_paths = list(pdf_paths)
+    shas = dict(shas or {})
+    settings = ocr_settings() if ocr_cache.enabled() else None
+    out, keys, pages, jobs = {}, {}, {}, []
+    for p in pdf_paths:
+        if settings is not None:
+            keys[p] = ocr_cache.cache_key(shas.get(p) or ocr_cache.file_sha256(p), settings)
+            cached = ocr_cache.get(keys[p])
+            if cached is not None:
+                print(f"[OCR] {os.path.basename(p)}: cache hit")
+                out[p] = cached
+                continue
+        native = native_page_texts(p) if OCR_NATIVE_TEXT else None
+        if native is None:
+            native = [""] * page_count(p)
+        pages[p] = native
+        missing = [i + 1 for i, t in enumerate(native) if not t]
+        print(f"[OCR] {os.path.basename(p)}: {len(native) - len(missing)}/{len(native)} pages from text layer")
+        jobs.extend(_windows(p, missing))
+
+    for (pdf_path, _, _), results in _run(jobs):
+        for page_no, text, secs in results:
+            print(f"[OCR] {os.path.basename(pdf_path)} p{page_no}: {secs:.2f}s")
+            pages[pdf_path][page_no - 1] = text
+
+    for p, parts in pages.items():
+        out[p] = "".join(parts)
+        if p in keys:
+            ocr_cache.put(keys[p], out[p])
+    if settings is not None:
+        print("[OCR] cache", ocr_cache.summary())
+    return {p: out[p] for p in pdf_paths}
+
+
+def extract_text_from_pdf(pdf_path: str) -> str:
+    """Text of all pages (text layer where present, Tesseract otherwise), concatenated."""
+    return extract_texts([pdf_path])[pdf_path]
@@ -0,0 +1,123 @@
+"""
+Content-addressed on-disk cache for OCR output.
+
+Key = SHA-256 of the PDF bytes + a hash of the OCR settings, so a resent PDF, a rerun of a
+batch script or a re-extraction after a prompt change never rasterizes the same file twice,
+while changing DPI/grayscale/etc. still produces fresh text.
+
+Entries are plain .txt files under OCR_CACHE_DIR. Hits touch the file's mtime, and when the
+directory grows past OCR_CACHE_MAX_MB the least recently used files are deleted. The counters and
+size tally are shared by the ingest's OCR threads and kept under a lock.
+
+Env:
+  OCR_CACHE_DIR=.ocr_cache
+  OCR_CACHE_MAX_MB=512   # 0 disables the cache
+"""
+
+import os
+import json
+import hashlib
+import threading
+from pathlib import Path
+
+OCR_CACHE_DIR    = Path(os.getenv("OCR_CACHE_DIR", ".ocr_cache"))
+OCR_CACHE_MAX_MB = int(os.getenv("OCR_CACHE_MAX_MB", "512"))
+
+stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+_size = None  # bytes currently on disk, computed on first write
+_lock = threading.Lock()  # guards stats and _size
+
+
+def enabled() -> bool:
+    return OCR_CACHE_MAX_MB > 0
+
+
+def file_sha256(path, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def cache_key(pdf_sha256: str, settings: dict) -> str:
+    s = hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16]
+    return f"{pdf_sha256}-{s}"
+
+
+def _path(key: str) -> Path:
+    return OCR_CACHE_DIR / key[:2] / f"{key}.txt"
+
+
+def get(key: str):
+    """Cached text for key, or None. A hit refreshes the entry's LRU position."""
+    if not enabled():
+        return None
+    path = _path(key)
+    try:
+        text = path.read_text(encoding="utf-8")
+    except FileNotFoundError:
+        with _lock:
+            stats["misses"] += 1
+        return None
+    try:
+        os.utime(path)
+    except FileNotFoundError:  # evicted by another thread just now; the text is still good
+        pass
+    with _lock:
+        stats["hits"] += 1
+    return text
+
+
+def put(key: str, text: str):
+    global _size
+    if not enabled():
+        return
+    path = _path(key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}-{threading.get_ident()}.tmp")  # one per writer
+    tmp.write_text(text, encoding="utf-8")
+    added = tmp.stat().st_size
+    try:
+        added -= path.stat().st_size  # replacing an entry: only the difference is new
+    except FileNotFoundError:
+        pass
+    os.replace(tmp, path)  # atomic: readers never see half a file
+
+    with _lock:
+        if _size is None:
+            _size = sum(p.stat().st_size for p in OCR_CACHE_DIR.rglob("*.txt"))
+        else:
+            _size += added
+        if _size > OCR_CACHE_MAX_MB * 1024 * 1024:
+            _evict()
+
+
+def _evict():
+    """Delete least recently used entries until the cache is back under 90% of its limit (caller holds _lock)."""
+    global _size
+    target = OCR_CACHE_MAX_MB * 1024 * 1024 * 0.9
+    entries = []
+    for p in OCR_CACHE_DIR.rglob("*.txt"):
+        try:
+            st = p.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, p))
+    entries.sort()
+    _size = sum(size for _, size, _ in entries)
+    for _, size, p in entries:
+        if _size <= target:
+            break
+        p.unlink(missing_ok=True)
+        _size -= size
+        stats["evictions"] += 1
+
+
+def summary() -> str:
+    with _lock:
+        hits, misses, evictions = stats["hits"], stats["misses"], stats["evictions"]
+    total = hits + misses
+    rate = (hits / total * 100) if total else 0.0
+    return f"hits={hits} misses={misses} evictions={evictions} hit_rate={rate:.0f}%"
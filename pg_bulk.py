@@ -0,0 +1,205 @@
+"""
+Batched writes into the invoice_ai schema.
+
+Instead of SELECT-then-INSERT per vendor/account/PO and one INSERT per invoice (up to 9 round
+trips per invoice), BulkInvoiceLoader buffers invoices and, per flush, resolves each dimension
+with ONE set-based `INSERT ... ON CONFLICT ... RETURNING` and inserts all invoices with ONE
+execute_values statement, all inside a single transaction.
+
+Dimension ids already in the shared DimensionCache (dim_cache.py) are not sent at all; new ids
+are added to the cache only after the batch commits.
+
+The ON CONFLICT clauses need unique indexes on vendors(name), accounts(number) and
+purchase_orders(po_number); ensure_unique_keys() creates them if they are missing. A table that
+already holds duplicate keys can't get its index: the duplicates are printed, and that table is
+written with select-then-insert until migrate_dedupe_dimensions.py has merged them.
+
+Usage:
+  with BulkInvoiceLoader(conn, table="invoices", batch_size=500) as loader:
+      for file_name, out in rows:
+          loader.add(file_name, out)
+"""
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from dim_cache import get_cache
+
+# table → (unique key, function building the row from extracted fields)
+DIMENSIONS = {
+    "vendors": ("name", lambda out: {
+        "name":    out.get("Vendor Name") or "",
+        "address": out.get("Vendor Address", ""),
+    }),
+    "accounts": ("number", lambda out: {
+        "number":  out.get("Account Number") or "",
+        "name":    out.get("Account Name", ""),
+        "manager": out.get("Account Manager", ""),
+    }),
+    "purchase_orders": ("po_number", lambda out: {
+        "po_number":      out.get("PO Number") or "",
+        "billing_period": out.get("Billing Period", ""),
+        "tax_code":       out.get("Tax Code", ""),
+        "tax_amount":     out.get("Tax Amount", ""),
+    }),
+}
+
+INVOICE_COLS = ["file", "invoice_number", "invoice_date", "due_date", "currency", "total_amount",
+                "vendor_id", "account_id", "po_id"]
+
+MIGRATION = "migrate_dedupe_dimensions.py"
+missing_unique = set()  # tables whose unique index couldn't be built (duplicate keys): no ON CONFLICT
+
+
+def ensure_unique_keys(cur):
+    """
+    Create the unique indexes ON CONFLICT relies on (no-op when they already exist). Each CREATE runs
+    under a savepoint, so duplicate keys only cost that table its index, not the caller's transaction.
+    """
+    for table, (key, _) in DIMENSIONS.items():
+        cur.execute("SAVEPOINT unique_key")
+        try:
+            cur.execute(
+                f"CREATE UNIQUE INDEX IF NOT EXISTS {table}_{key}_uniq ON invoice_ai.{table} ({key})"
+            )
+        except psycopg2.errors.UniqueViolation:
+            cur.execute("ROLLBACK TO SAVEPOINT unique_key")
+            cur.execute(f"""
+                SELECT {key}, COUNT(*) FROM invoice_ai.{table}
+                GROUP BY {key} HAVING COUNT(*) > 1
+                ORDER BY COUNT(*) DESC LIMIT 20
+            """)
+            dupes = ", ".join(f"{k!r} ×{n}" for k, n in cur.fetchall())
+            print(f"⚠️ [PG] invoice_ai.{table} has duplicate {key} values ({dupes}); no unique index, "
+                  f"using select-then-insert. Run {MIGRATION} to merge them.")
+            missing_unique.add(table)
+            continue
+        cur.execute("RELEASE SAVEPOINT unique_key")
+        missing_unique.discard(table)
+
+
+def _select_or_insert(cur, table, key, unique: dict) -> dict:
+    """upsert_dimension for a table without its unique index: existing ids first (lowest of duplicates), insert the rest."""
+    cur.execute(
+        f"SELECT {key}, MIN(id) FROM invoice_ai.{table} WHERE {key} = ANY(%s) GROUP BY {key}",
+        (list(unique),),
+    )
+    ids = dict(cur.fetchall())
+    new = [r for k, r in unique.items() if k not in ids]
+    if new:
+        cols = list(new[0].keys())
+        sql = f"INSERT INTO invoice_ai.{table} ({','.join(cols)}) VALUES %s RETURNING {key}, id"
+        values = [tuple(r[c] for c in cols) for r in new]
+        ids.update(execute_values(cur, sql, values, page_size=len(values), fetch=True))
+    return ids
+
+
+def upsert_dimension(cur, table, rows: list) -> dict:
+    """
+    Insert-or-find many dimension rows in one statement. Returns {key value: id}.
+    The no-op DO UPDATE makes RETURNING include rows that already existed.
+    """
+    key, _ = DIMENSIONS[table]
+    unique = {}
+    for r in rows:
+        unique.setdefault(r[key], r)  # ON CONFLICT can't touch the same row twice in one statement
+    if not unique:
+        return {}
+    if table in missing_unique:
+        return _select_or_insert(cur, table, key, unique)
+    cols = list(next(iter(unique.values())).keys())
+    sql = (
+        f"INSERT INTO invoice_ai.{table} ({','.join(cols)}) VALUES %s "
+        f"ON CONFLICT ({key}) DO UPDATE SET {key} = EXCLUDED.{key} "
+        f"RETURNING {key}, id"
+    )
+    values = [tuple(r[c] for c in cols) for r in unique.values()]
+    return dict(execute_values(cur, sql, values, page_size=len(values), fetch=True))
+
+
+class BulkInvoiceLoader:
+    """Buffer (file, fields) pairs and write them to invoice_ai.<table> in set-based batches."""
+
+    def __init__(self, conn, table="invoices", batch_size=500, row_values=None, cache=None):
+        self.conn = conn
+        self.cache = cache or get_cache()
+        self.table = table
+        self.batch_size = batch_size
+        # row_values(out) → (invoice_number, invoice_date, due_date, currency, total_amount)
+        self.row_values = row_values or (lambda out: (
+            out.get("Invoice Number"), out.get("Invoice Date"), out.get("Due Date"),
+            out.get("Currency"), out.get("Total Amount"),
+        ))
+        self.buffer = []
+        self.ids = {}  # file → invoice id for everything flushed so far
+        self._checked_keys = False
+
+    def add(self, file_name, out):
+        self.buffer.append((file_name, out))
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> dict:
+        """Write the buffered invoices in one transaction. Returns {file: invoice_id} for this batch."""
+        if not self.buffer:
+            return {}
+        batch, self.buffer = self.buffer, []
+        try:
+            inserted = self._write(batch)
+        except psycopg2.errors.ForeignKeyViolation:
+            # a cached id no longer exists (row merged/deleted elsewhere): drop cached ids, retry once
+            print("[PG] stale dimension id in cache, retrying batch without it")
+            for table in DIMENSIONS:
+                self.cache.invalidate(table)
+            inserted = self._write(batch)
+        print(f"[PG] flushed {len(batch)} invoices ({len(inserted)} new) into invoice_ai.{self.table}"
+              f" | dim cache {self.cache.summary()}")
+        self.ids.update(inserted)
+        return inserted
+
+    def _write(self, batch) -> dict:
+        autocommit = self.conn.autocommit
+        self.conn.autocommit = False
+        try:
+            with self.conn:  # commit on success, rollback on error
+                with self.conn.cursor() as cur:
+                    if not self._checked_keys:
+                        ensure_unique_keys(cur)
+                        self._checked_keys = True
+                    dims = [{t: build(out) for t, (_, build) in DIMENSIONS.items()} for _, out in batch]
+                    dim_ids, fresh = {}, {}
+                    for t, (key, _) in DIMENSIONS.items():
+                        dim_ids[t], misses = {}, []
+                        for d in dims:
+                            k = d[t][key]
+                            if k in dim_ids[t]:
+                                continue
+                            id_ = self.cache.get(t, k)
+                            if id_ is None:
+                                misses.append(d[t])
+                            else:
+                                dim_ids[t][k] = id_
+                        fresh[t] = upsert_dimension(cur, t, misses)
+                        dim_ids[t].update(fresh[t])
+                    rows = [
+                        (file_name, *self.row_values(out),
+                         *(dim_ids[t][d[t][key]] for t, (key, _) in DIMENSIONS.items()))
+                        for (file_name, out), d in zip(batch, dims)
+                    ]
+                    sql = (
+                        f"INSERT INTO invoice_ai.{self.table} ({','.join(INVOICE_COLS)}) VALUES %s "
+                        f"ON CONFLICT (file) DO NOTHING RETURNING file, id"
+                    )
+                    inserted = dict(execute_values(cur, sql, rows, page_size=len(rows), fetch=True))
+        finally:
+            self.conn.autocommit = autocommit
+        for t, mapping in fresh.items():  # committed → safe to share
+            self.cache.put_many(t, mapping)
+        return inserted
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
@@ -0,0 +1,94 @@
+"""
+Pooled Postgres connections and a transactional unit of work.
+
+Instead of one global autocommit connection (every statement its own transaction + fsync, one
+cursor shared by everyone), workers borrow a connection from a ThreadedConnectionPool and wrap
+all writes for one email in a single transaction:
+
+    with unit_of_work() as cur:
+        invoice_id = insert_invoice_email_pipeline(cur, file_name, fields)
+        insert_email_invoice(cur, invoice_id, file_name, msg)
+
+Commit on success, rollback on any exception; callbacks registered with cur.after_commit(fn)
+run only once the transaction is durable (used to publish new ids to the dimension cache).
+Connections that died (server restart, idle timeout) are discarded instead of returned to the pool.
+
+Env: PG_DB, PG_USER, PG_PASSWORD, PG_HOST, PG_PORT (point them at a local Postgres for testing)
+  PG_POOL_MIN=1
+  PG_POOL_MAX=8
+"""
+
+import os
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import ThreadedConnectionPool
+
+PG_POOL_MIN = int(os.getenv("PG_POOL_MIN", "1"))
+PG_POOL_MAX = int(os.getenv("PG_POOL_MAX", "8"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class UnitCursor(psycopg2.extensions.cursor):
+    """Cursor that collects callbacks to run after its transaction commits."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._after_commit = []
+
+    def after_commit(self, fn):
+        self._after_commit.append(fn)
+
+
+def get_pool() -> ThreadedConnectionPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadedConnectionPool(
+                PG_POOL_MIN, PG_POOL_MAX,
+                dbname=os.getenv("PG_DB", "invoice_db"),
+                user=os.getenv("PG_USER", "postgres"),
+                password=os.getenv("PG_PASSWORD", ""),
+                host=os.getenv("PG_HOST", "localhost"),
+                port=os.getenv("PG_PORT", "5432"),
+            )
+    return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+@contextmanager
+def unit_of_work():
+    """Borrow a pooled connection and run the block as one transaction; yields a UnitCursor."""
+    pool = get_pool()
+    conn = pool.getconn()
+    broken = False
+    try:
+        if conn.closed:
+            pool.putconn(conn, close=True)
+            conn = pool.getconn()
+        conn.autocommit = False
+        with conn.cursor(cursor_factory=UnitCursor) as cur:
+            try:
+                yield cur
+                conn.commit()
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                broken = True
+                raise
+            except BaseException:
+                conn.rollback()
+                raise
+        for fn in cur._after_commit:
+            fn()
+    finally:
+        pool.putconn(conn, close=broken or bool(conn.closed))
@@ -0,0 +1,185 @@
+"""
+Small staged pipeline: items flow through stages connected by bounded queues, and every stage
+runs its own workers, so while one invoice is being OCR'd another is waiting on GPT and a third
+is being written. Throughput is set by the slowest stage instead of the sum of all stages.
+
+- kind="thread": `workers` threads each call fn(item) (use for blocking work: OCR, which fans
+  out to ocr.py's process pool, or the single Postgres/Excel writer).
+- kind="async": `workers` coroutines on an asyncio loop each await fn(item) (use for network I/O
+  such as the LLM calls). Pass `loop` to run them on an existing loop thread. Their blocking
+  queue get/put run on the stage's own thread pool (one thread per pending call), not the loop's
+  default executor, which is smaller than `workers` on small machines and would hold finished items
+  back behind parked get()s.
+
+Queues are bounded (PIPELINE_QUEUE_SIZE), so a fast producer blocks in submit() instead of
+piling work up in memory. If a stage raises, the item continues as a Failed(item, stage, error)
+that later stages pass through untouched, so every submitted item comes out of results() once.
+
+    pipe = Pipeline([Stage("ocr", ocr_fn, 2), Stage("llm", llm_fn, 8, kind="async"), Stage("db", db_fn, 1)])
+    pipe.start()
+    for item in items:
+        pipe.submit(item)
+    pipe.close()
+    for out in pipe.results():
+        ...
+
+Env:
+  PIPELINE_QUEUE_SIZE=8
+"""
+
+import os
+import time
+import queue
+import asyncio
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "8"))
+
+_DONE = object()  # end-of-stream marker
+
+
+class Failed:
+    def __init__(self, item, stage, error):
+        self.item = item
+        self.stage = stage
+        self.error = error
+
+    def __repr__(self):
+        return f"Failed({self.stage}: {self.error!r})"
+
+
+class Stage:
+    def __init__(self, name, fn, workers=1, kind="thread", loop=None):
+        assert kind in ("thread", "async")
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.kind = kind
+        self.loop = loop
+        self.busy_seconds = 0.0
+        self.count = 0
+
+
+class Pipeline:
+    def __init__(self, stages, maxsize=PIPELINE_QUEUE_SIZE):
+        self.stages = stages
+        # queues[i] feeds stages[i]; the last queue collects results (unbounded, drained by the caller)
+        self.queues = [queue.Queue(maxsize=maxsize) for _ in stages] + [queue.Queue()]
+        self._remaining = [s.workers for s in stages]
+        self._lock = threading.Lock()
+        self._threads = []
+        self._executors = {}  # async stage index → its queue-bridging thread pool
+        self._own_loop = None
+
+    # ---------- wiring ----------
+
+    def start(self):
+        for i, stage in enumerate(self.stages):
+            if stage.kind == "thread":
+                for n in range(stage.workers):
+                    t = threading.Thread(target=self._thread_worker, args=(i,),
+                                         name=f"{stage.name}-{n}", daemon=True)
+                    t.start()
+                    self._threads.append(t)
+            else:
+                loop = stage.loop or self._loop()
+                # every worker has at most one get() or put() pending, plus headroom for the hand-over
+                self._executors[i] = ThreadPoolExecutor(max_workers=stage.workers * 2,
+                                                        thread_name_prefix=f"{stage.name}-queue")
+                for _ in range(stage.workers):
+                    asyncio.run_coroutine_threadsafe(self._async_worker(i), loop)
+        return self
+
+    def _loop(self):
+        if self._own_loop is None:
+            self._own_loop = asyncio.new_event_loop()
+            threading.Thread(target=self._own_loop.run_forever, name="pipeline-loop", daemon=True).start()
+        return self._own_loop
+
+    def _worker_finished(self, i):
+        """Last worker of stage i to exit passes end-of-stream on to the next stage."""
+        with self._lock:
+            self._remaining[i] -= 1
+            last = self._remaining[i] == 0
+        if last:
+            nxt = self.stages[i + 1].workers if i + 1 < len(self.stages) else 1
+            for _ in range(nxt):
+                self.queues[i + 1].put(_DONE)
+
+    def _run(self, stage, item, result_or_exc):
+        if isinstance(result_or_exc, BaseException):
+            print(f"❌ [{stage.name}] {result_or_exc}")
+            traceback.print_exception(type(result_or_exc), result_or_exc, result_or_exc.__traceback__)
+            return Failed(item, stage.name, result_or_exc)
+        return result_or_exc
+
+    # ---------- workers ----------
+
+    def _thread_worker(self, i):
+        stage, in_q, out_q = self.stages[i], self.queues[i], self.queues[i + 1]
+        while True:
+            item = in_q.get()
+            if item is _DONE:
+                break
+            if not isinstance(item, Failed):
+                t0 = time.perf_counter()
+                try:
+                    result = stage.fn(item)
+                except Exception as e:
+                    result = e
+                stage.busy_seconds += time.perf_counter() - t0
+                stage.count += 1
+                item = self._run(stage, item, result)
+            out_q.put(item)  # blocks when the next stage is behind → backpressure
+        self._worker_finished(i)
+
+    async def _async_worker(self, i):
+        stage, in_q, out_q = self.stages[i], self.queues[i], self.queues[i + 1]
+        loop, bridge = asyncio.get_running_loop(), self._executors[i]
+        while True:
+            item = await loop.run_in_executor(bridge, in_q.get)
+            if item is _DONE:
+                break
+            if not isinstance(item, Failed):
+                t0 = time.perf_counter()
+                try:
+                    result = await stage.fn(item)
+                except Exception as e:
+                    result = e
+                stage.busy_seconds += time.perf_counter() - t0
+                stage.count += 1
+                item = self._run(stage, item, result)
+            await loop.run_in_executor(bridge, out_q.put, item)
+        self._worker_finished(i)
+
+    # ---------- producer / consumer side ----------
+
+    def submit(self, item):
+        """Feed the first stage; blocks while its queue is full."""
+        self.queues[0].put(item)
+
+    def close(self):
+        """No more items: let every first-stage worker drain and exit."""
+        for _ in range(self.stages[0].workers):
+            self.queues[0].put(_DONE)
+
+    def results(self):
+        """Yield every processed item (or Failed) until the pipeline has drained; call after close()."""
+        out_q = self.queues[-1]
+        while True:
+            item = out_q.get()
+            if item is _DONE:
+                break
+            yield item
+        for ex in self._executors.values():
+            ex.shutdown(wait=False)
+        if self._own_loop is not None:
+            self._own_loop.call_soon_threadsafe(self._own_loop.stop)
+
+    def summary(self) -> str:
+        return " | ".join(
+            f"{s.name}: {s.count} items, {s.busy_seconds:.1f}s busy over {s.workers} worker(s)"
+            for s in self.stages
+        )
@@ -1,11 +1,12 @@
 import time, subprocess, sys, os
 BASE = os.path.dirname(os.path.abspath(__file__))
-CMD = [os.path.join(BASE, "venv/bin/python"), os.path.join(BASE, "ingest_outlook_imap_to_postgres.py")]
+CMD = [os.path.join(BASE, "venv/bin/python"), os.path.join(BASE, "ingest_outlook_imap_to_postgres.py"), "--daemon"]
 
+# The ingest stays resident (IMAP IDLE); this loop only restarts it if it exits.
 while True:
-    print("▶︎ Running ingest...")
+    print("▶︎ Starting ingest daemon...")
     try:
         subprocess.run(CMD, check=False)
     except Exception as e:
         print("ERROR:", e)
-    time.sleep(120)  # poll every 2 minutes
+    time.sleep(10)  # short pause before restart
@@ -0,0 +1,109 @@
+"""
+End-to-end run of llm_batch.run_batch_job against a local stub of the Files + Batches API
+(OPENAI_BASE_URL), so the submit → poll → collect → resume path runs without the real API or OCR.
+
+  python test_llm_batch.py
+"""
+
+import os
+import json
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TMP = tempfile.mkdtemp(prefix="llm_batch_test_")
+os.environ["OPENAI_API_KEY"] = "sk-stub"
+os.environ["LLM_CACHE_PATH"] = os.path.join(TMP, "llm_cache.sqlite")
+os.environ["OCR_CACHE_DIR"] = os.path.join(TMP, "ocr_cache")
+
+FIELDS = {"Invoice Number": "INV-1", "Total Amount": "$10.00"}
+
+
+class StubAPI(BaseHTTPRequestHandler):
+    """Just enough of /v1/files and /v1/batches: every batch is completed on creation."""
+    files, batches = {}, {}
+
+    def _send(self, body, ctype="application/json"):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.endswith("/files"):  # multipart upload: keep the JSONL request lines
+            lines = [l for l in body.split(b"\n") if l.startswith(b'{"custom_id"')]
+            fid = f"file-{len(self.files)}"
+            self.files[fid] = lines
+            return self._send({"id": fid, "object": "file", "bytes": len(body), "created_at": 0,
+                               "filename": "input.jsonl", "purpose": "batch", "status": "processed"})
+        if self.path.endswith("/batches"):
+            req = json.loads(body)
+            out = [json.dumps({"id": f"r{i}", "custom_id": json.loads(l)["custom_id"], "error": None,
+                               "response": {"status_code": 200, "body": {"choices": [
+                                   {"message": {"content": json.dumps(FIELDS)}}]}}})
+                   for i, l in enumerate(self.files[req["input_file_id"]])]
+            out_id = f"file-{len(self.files)}"
+            self.files[out_id] = [l.encode() for l in out]
+            bid = f"batch_{len(self.batches)}"
+            self.batches[bid] = {
+                "id": bid, "object": "batch", "endpoint": req["endpoint"], "errors": None,
+                "input_file_id": req["input_file_id"], "completion_window": "24h", "status": "completed",
+                "output_file_id": out_id, "error_file_id": None, "created_at": 0,
+                "request_counts": {"total": len(out), "completed": len(out), "failed": 0},
+            }
+            return self._send(self.batches[bid])
+        self.send_error(404)
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")  # v1/batches/<id> or v1/files/<id>/content
+        if parts[-2] == "batches":
+            return self._send(self.batches[parts[-1]])
+        if parts[-1] == "content":
+            return self._send(b"\n".join(self.files[parts[-2]]) + b"\n", "application/octet-stream")
+        self.send_error(404)
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubAPI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/v1"
+
+    import llm_batch
+    llm_batch.extract_texts = lambda paths, shas=None: {p: f"invoice text of {os.path.basename(p)}" for p in paths}
+
+    pdf_dir = os.path.join(TMP, "pdfs")
+    os.makedirs(pdf_dir)
+    names = [f"inv{i}.pdf" for i in range(3)]
+    for n in names:
+        with open(os.path.join(pdf_dir, n), "wb") as f:
+            f.write(b"%PDF-1.4 " + n.encode())
+    out = os.path.join(TMP, "results_batch.jsonl")
+
+    llm_batch.run_batch_job(pdf_dir, out, poll_interval=0)
+    with open(out) as f:
+        rows = [json.loads(l) for l in f]
+    assert sorted(r["file"] for r in rows) == names, rows
+    assert all(r.get("sha256") for r in rows), "results written without a PDF hash"
+    assert not os.path.exists(out + ".batch.json"), "state file left behind"
+
+    llm_batch.run_batch_job(pdf_dir, out, poll_interval=0)  # everything indexed: nothing resubmitted
+    assert len(StubAPI.batches) == 1, StubAPI.batches
+    with open(out) as f:
+        assert sum(1 for _ in f) == len(names)
+
+    os.remove(out)
+    os.remove(out + ".idx")
+    llm_batch.run_batch_job(pdf_dir, out, poll_interval=0)  # fresh results file: answered from llm_cache
+    assert len(StubAPI.batches) == 1, StubAPI.batches
+    print(f"✅ llm_batch against the stub API: {len(names)} results, resume + cache OK ({TMP})")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+Per-vendor date formats, learned from the dates themselves and kept across runs.
+
+A vendor prints its dates one way, but "10/09/2025" alone can't say whether that is 10 Sep (DD/MM)
+or 9 Oct (MM/DD); normalize_date and as_date used to guess MM/DD for every value. Here every
+unambiguous numeric date (day > 12, e.g. "22/09/2025") counts as a vote for its format under that
+vendor, and the format with most votes is the vendor's:
+
+- parse(vendor, s) tries the vendor's format first: one strptime for the common case.
+- otherwise it tries FORMATS; an ambiguous value is read in the vendor's day/month order.
+- dayfirst(vendor) tells dateutil the same for values outside FORMATS.
+
+Votes live in VENDOR_DATE_FORMATS_PATH (JSON, {vendor: {format: votes}}), saved whenever a vendor's
+format is first learned or changes, and at exit.
+
+    python vendor_dates.py            # list the learned formats
+
+Env:
+  VENDOR_DATE_FORMATS_PATH=.vendor_date_formats.json
+"""
+
+import os
+import json
+import atexit
+import threading
+from datetime import datetime
+
+VENDOR_DATE_FORMATS_PATH = os.getenv("VENDOR_DATE_FORMATS_PATH", ".vendor_date_formats.json")
+
+# tried in this order; without a learned order the earlier one wins (MM/DD before DD/MM, as before)
+FORMATS = [
+    "%Y-%m-%d", "%Y/%m/%d",
+    "%m-%d-%Y", "%m/%d/%Y",
+    "%d-%m-%Y", "%d/%m/%Y", "%d.%m.%Y",
+    "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S",
+    "%B %d, %Y", "%b %d, %Y", "%d %B %Y", "%d %b %Y",
+]
+# numeric day and month before the year: the ones where the order has to be learned
+ORDERED = [f for f in FORMATS if f.endswith("%Y") and "%d" in f and "%m" in f]
+
+_lock = threading.Lock()
+_votes = None        # {vendor key: {format: votes}}, loaded on first use
+_preferred = {}      # {vendor key: format with most votes}
+_dirty = False
+
+
+def key(vendor):
+    """Registry key: case- and whitespace-insensitive vendor name ("" for none)."""
+    return " ".join(str(vendor or "").split()).casefold()
+
+
+def dayfirst_format(fmt) -> bool:
+    return fmt.index("%d") < fmt.index("%m")
+
+
+def swapped(fmt):
+    """The same format with day and month exchanged ("%d/%m/%Y" ↔ "%m/%d/%Y")."""
+    return fmt.replace("%d", "\0").replace("%m", "%d").replace("\0", "%m")
+
+
+def unambiguous(s, fmt) -> bool:
+    """True if `s` can't be read with day and month exchanged ("22/09/2025", not "10/09/2025" or "05/05/2025")."""
+    try:
+        datetime.strptime(s, swapped(fmt))
+    except ValueError:
+        return True
+    return False
+
+
+def _load():
+    global _votes
+    if _votes is not None:
+        return
+    _votes = {}
+    try:
+        with open(VENDOR_DATE_FORMATS_PATH, "r", encoding="utf-8") as f:
+            _votes = {k: {fmt: int(n) for fmt, n in v.items() if fmt in ORDERED} for k, v in json.load(f).items()}
+    except FileNotFoundError:
+        pass
+    except (ValueError, AttributeError) as e:
+        print(f"[DATES] ignoring unreadable {VENDOR_DATE_FORMATS_PATH}: {e}")
+    for k, v in _votes.items():
+        if v:
+            _preferred[k] = max(v, key=v.get)
+    atexit.register(save)
+
+
+def save():
+    global _dirty
+    with _lock:
+        if not _dirty:
+            return
+        tmp = VENDOR_DATE_FORMATS_PATH + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(_votes, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp, VENDOR_DATE_FORMATS_PATH)
+        _dirty = False
+
+
+def preferred(vendor):
+    """The vendor's learned numeric format, or None."""
+    k = key(vendor)
+    if not k:
+        return None
+    with _lock:
+        _load()
+        return _preferred.get(k)
+
+
+def dayfirst(vendor) -> bool:
+    fmt = preferred(vendor)
+    return bool(fmt) and dayfirst_format(fmt)
+
+
+def learn(vendor, fmt, votes=1):
+    """Count `votes` unambiguous dates in `fmt` for the vendor; saves when its format changes."""
+    global _dirty
+    k = key(vendor)
+    if not k or fmt not in ORDERED or votes <= 0:
+        return
+    with _lock:
+        _load()
+        v = _votes.setdefault(k, {})
+        v[fmt] = v.get(fmt, 0) + votes
+        before, after = _preferred.get(k), max(v, key=v.get)
+        _preferred[k] = after
+        _dirty = True
+    if after != before:
+        print(f"[DATES] {vendor}: {after}" + (f" (was {before})" if before else ""))
+        save()
+
+
+def parse(vendor, s):
+    """datetime for `s` in one of FORMATS, read in the vendor's day/month order; None if none fits."""
+    s = str(s or "").strip()
+    if not s:
+        return None
+    fmt = preferred(vendor)
+    if fmt:
+        try:
+            return datetime.strptime(s, fmt)
+        except ValueError:
+            pass
+    hits = []
+    for f in FORMATS:
+        try:
+            hits.append((f, datetime.strptime(s, f)))
+        except ValueError:
+            pass
+    if not hits:
+        return None
+    if len(hits) == 1:
+        f, dt = hits[0]
+        if f in ORDERED and unambiguous(s, f):
+            learn(vendor, f)
+        return dt
+    if fmt:  # ambiguous: the vendor's order
+        for f, dt in hits:
+            if f in ORDERED and dayfirst_format(f) == dayfirst_format(fmt):
+                return dt
+    return hits[0][1]
+
+
+if __name__ == "__main__":
+    _load()
+    for k, v in sorted(_votes.items()):
+        print(f"{k}\t{_preferred.get(k)}\t" + ", ".join(f"{f}={n}" for f, n in sorted(v.items(), key=lambda x: -x[1])))